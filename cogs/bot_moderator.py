@@ -109,8 +109,7 @@ class ModeratorOnly(utils.Cog):
         # Update database
         async with self.bot.database() as db:
             await db.marry(user_a, user_b, ctx.family_guild_id)
-        me._partner = user_b
-        them._partner = user_a
+        me.add_partner(them)
         await ctx.send("Consider it done.")
 
     @commands.command()
@@ -129,8 +128,7 @@ class ModeratorOnly(utils.Cog):
             await db('DELETE FROM marriages WHERE (user_id=$1 OR partner_id=$1) AND guild_id=$2', user, ctx.family_guild_id)
 
         # Update cache
-        me.partner._partner = None
-        me._partner = None
+        me.remove_partner()
         await ctx.send("Consider it done.")
 
     @commands.command()
@@ -156,8 +154,7 @@ class ModeratorOnly(utils.Cog):
 
         # Update cache
         me = utils.FamilyTreeMember.get(parent, ctx.family_guild_id)
-        me._children.append(child)
-        them._parent = parent
+        me.add_child(them)
         async with self.bot.redis() as re:
             await re.publish_json('TreeMemberUpdate', me.to_json())
             await re.publish_json('TreeMemberUpdate', them.to_json())
@@ -179,9 +176,8 @@ class ModeratorOnly(utils.Cog):
             await db('DELETE FROM parents WHERE child_id=$1 AND guild_id=$2', me.id, me._guild_id)
 
         # Update cache
-        me.parent._children.remove(user)
         parent = me.parent
-        me._parent = None
+        parent.remove_child(me)
         async with self.bot.redis() as re:
             await re.publish_json('TreeMemberUpdate', me.to_json())
             await re.publish_json('TreeMemberUpdate', parent.to_json())
@@ -54,7 +54,7 @@ class ErrorHandler(utils.Cog):
 
         # Cooldown
         elif isinstance(error, commands.CommandOnCooldown):
-            if ctx.command.name in ['tree', 'globaltree']:
+            if ctx.command.name in ['tree', 'globaltree', 'neighbourhoodtree']:
                 return await self.tree_timeout_handler(ctx, error)
             return await ctx.send(f"You can only use this command once every `{error.cooldown.per:.0f} seconds` per server. You may use this again in `{error.retry_after:.2f} seconds`.")
 
@@ -100,6 +100,14 @@ class ErrorHandler(utils.Cog):
         elif isinstance(error, commands.DisabledCommand):
             return await ctx.send("This command has been temporarily disabled. Apologies for any inconvenience.")
 
+        # Too many trees waiting to render
+        elif isinstance(error, utils.errors.RenderQueueFull):
+            return await ctx.send(str(error))
+
+        # Graphviz couldn't render a tree
+        elif isinstance(error, utils.errors.TreeRenderFailed):
+            return await ctx.send(str(error))
+
         # Bot ready
         elif isinstance(error, utils.errors.BotNotReady):
             return await ctx.send("The bot isn't ready to start processing that command yet - please wait.")
@@ -0,0 +1,34 @@
+from discord.ext import tasks
+
+from cogs import utils
+
+
+class FamilyTreeSweeper(utils.Cog):
+
+    def __init__(self, bot:utils.CustomBot):
+        super().__init__(bot)
+        self.sweep_loop.start()
+
+    def cog_unload(self):
+        self.sweep_loop.cancel()
+
+    @tasks.loop(minutes=10)
+    async def sweep_loop(self):
+        """Removes users with no relations left from the family tree cache, or compacts the
+        family tree cache if it's the compact store"""
+
+        if not self.bot.is_ready():
+            return
+        if isinstance(utils.FamilyTreeMember.all_users, utils.CompactFamilyStore):
+            compacted = utils.FamilyTreeMember.all_users.compact()
+            if compacted:
+                self.log_handler.info(f"Compacted the children of {compacted} changed users in the family tree cache")
+            return
+        removed = utils.FamilyTreeMember.sweep_empty()
+        if removed:
+            self.log_handler.info(f"Swept {removed} empty users from the family tree cache ({utils.FamilyTreeMember.reclaimed_bytes / 2**20:.2f}MB reclaimed in total)")
+
+
+def setup(bot:utils.CustomBot):
+    x = FamilyTreeSweeper(bot)
+    bot.add_cog(x)
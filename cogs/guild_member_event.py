@@ -0,0 +1,29 @@
+import discord
+
+from cogs import utils
+
+
+class GuildMemberEvent(utils.Cog):
+
+    @utils.Cog.listener()
+    async def on_member_join(self, member:discord.Member):
+        """Throws away the cached member list for the guild, since it's out of date now"""
+
+        utils.FamilyTreeMember.guild_members.invalidate(member.guild.id)
+
+    @utils.Cog.listener()
+    async def on_member_remove(self, member:discord.Member):
+        """Throws away the cached member list for the guild, since it's out of date now"""
+
+        utils.FamilyTreeMember.guild_members.invalidate(member.guild.id)
+
+    @utils.Cog.listener()
+    async def on_guild_remove(self, guild:discord.Guild):
+        """Throws away the cached member list for a guild the bot's been removed from"""
+
+        utils.FamilyTreeMember.guild_members.invalidate(guild.id)
+
+
+def setup(bot:utils.CustomBot):
+    x = GuildMemberEvent(bot)
+    bot.add_cog(x)
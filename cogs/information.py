@@ -1,4 +1,5 @@
 import asyncio
+import os
 import typing
 import io
 from datetime import datetime as dt
@@ -12,6 +13,14 @@ from cogs import utils
 class Information(utils.Cog):
     """The information cog, handling telling the user what they want to hear"""
 
+    RENDER_OPTIONS = ('-Gcharset=UTF-8',)  # The options given to Graphviz when rendering trees (as well as the output format) - part of the render cache key
+    QUEUE_MESSAGE = "Your tree is number {0} in the queue - it'll be sent here once it's been rendered."
+
+    def __init__(self, bot:utils.CustomBot):
+        super().__init__(bot)
+        self.in_flight_renders: typing.Dict[tuple, utils.SharedRender] = {}  # Render key: the render that's currently running for it
+        self.coalesced_renders = 0  # How many tree commands have shared another's render
+
     @commands.command(aliases=['spouse', 'husband', 'wife', 'marriage'])
     @commands.cooldown(1, 5, commands.BucketType.user)
     @utils.checks.bot_is_ready()
@@ -111,7 +120,7 @@ class Information(utils.Cog):
         user_tree = utils.FamilyTreeMember.get(user, ctx.family_guild_id)
         other_tree = utils.FamilyTreeMember.get(other, ctx.family_guild_id)
         async with ctx.channel.typing():
-            relation = user_tree.get_relation(other_tree)
+            relation = await user_tree.get_relation_in_worker(other_tree)
 
         # Get names
         user_name = await self.bot.get_name(user)
@@ -140,7 +149,7 @@ class Information(utils.Cog):
         username = await self.bot.get_name(user)
         await ctx.send(f"There are `{size}` people in `{username}`'s family tree.")
 
-    @commands.command(enabled=False)
+    @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.user)
     @commands.bot_has_permissions(attach_files=True)
     @utils.checks.bot_is_ready()
@@ -148,16 +157,18 @@ class Information(utils.Cog):
         """Gives you the full family tree of a user"""
 
         root_user_id = root or ctx.author.id
+        file_bytes = io.BytesIO()
         async with ctx.channel.typing():
-            text = await utils.FamilyTreeMember.get(root_user_id, ctx.family_guild_id).generate_gedcom_script(self.bot)
-        file_bytes = io.BytesIO(text.encode())
+            async for line in utils.FamilyTreeMember.get(root_user_id, ctx.family_guild_id).generate_gedcom_lines(self.bot):
+                file_bytes.write(line.encode() + b'\n')
+        file_bytes.seek(0)
         await ctx.send(file=discord.File(file_bytes, filename=f'tree_of_{root_user_id}.ged'))
 
     @commands.command(aliases=['familytree', 't', 'fulltree', 'ft', 'gt'])
     @commands.cooldown(1, 60, commands.BucketType.user)
     @commands.bot_has_permissions(attach_files=True)
     @utils.checks.bot_is_ready()
-    async def tree(self, ctx:utils.Context, root:typing.Optional[utils.converters.UserID]):
+    async def tree(self, ctx:utils.Context, root:typing.Optional[utils.converters.UserID], image_format:utils.converters.TreeImageFormat=None):
         """Gets the family tree of a given user"""
 
         try:
@@ -165,6 +176,25 @@ class Information(utils.Cog):
                 ctx=ctx,
                 root_user_id=root,
                 all_guilds=True,
+                image_format=image_format,
+            )
+        except Exception as e:
+            raise e
+
+    @commands.command(aliases=['nt', 'neighborhoodtree', 'closetree'])
+    @commands.cooldown(1, 60, commands.BucketType.user)
+    @commands.bot_has_permissions(attach_files=True)
+    @utils.checks.bot_is_ready()
+    async def neighbourhoodtree(self, ctx:utils.Context, generations:typing.Optional[utils.converters.GenerationCount]=2, root:typing.Optional[utils.converters.UserID]=None, image_format:utils.converters.TreeImageFormat=None):
+        """Gets the family tree of just the people a few generations either side of a given user"""
+
+        try:
+            return await self.treemaker(
+                ctx=ctx,
+                root_user_id=root,
+                all_guilds=True,
+                image_format=image_format,
+                generations=generations,
             )
         except Exception as e:
             raise e
@@ -174,19 +204,97 @@ class Information(utils.Cog):
     @utils.checks.is_patreon(tier=2)
     @commands.bot_has_permissions(attach_files=True)
     @utils.checks.bot_is_ready()
-    async def stupidtree(self, ctx:utils.Context, root:typing.Optional[utils.converters.UserID]):
+    async def stupidtree(self, ctx:utils.Context, root:typing.Optional[utils.converters.UserID], image_format:utils.converters.TreeImageFormat=None):
         """Gets the family tree of a given user"""
 
         try:
             return await self.treemaker(
                 ctx=ctx,
                 root_user_id=root,
-                stupid_tree=True
+                stupid_tree=True,
+                image_format=image_format,
             )
         except Exception as e:
             raise e
 
-    async def treemaker(self, ctx:utils.Context, root_user_id:int, all_guilds:bool=False, stupid_tree:bool=False):
+    async def get_render_priority(self, ctx:utils.Context) -> int:
+        """Gives you the render queue priority for the author of a command - Gold and Patreon
+        subscribers get their trees rendered before everyone else"""
+
+        if not self.bot.render_queue.is_busy:
+            return 0  # No point checking their tier if they'll be rendered straight away
+        if self.bot.is_server_specific:
+            return -len(self.bot.config['patreon_roles']) - 1
+        return -await utils.checks.get_patreon_tier(self.bot, ctx.author)
+
+    async def render_tree(self, ctx:typing.Optional[utils.Context], dot_code:str, cache_key:str, output_format:str='png', priority:int=None, niceness:int=0, shared_render:utils.SharedRender=None) -> bytes:
+        """Renders a DOT script into an image, saving it into the render cache if there is one
+        Background renders don't have a context, so they need to be given a priority instead, and can
+        be given a niceness for the Graphviz process. Renders shared between several tree commands are
+        queued at the best of their priorities, and everyone sharing it is told its place in the queue"""
+
+        # Wait for a free renderer
+        render_cache = self.bot.render_cache
+        if priority is None:
+            priority = await self.get_render_priority(ctx)
+        contexts = [ctx]
+        if shared_render is not None:
+            shared_render.add_priority(priority)
+            priority = shared_render.priority
+            contexts = list(shared_render.contexts)
+        ticket = self.bot.render_queue.join(priority)
+        if shared_render is not None:
+            shared_render.ticket = ticket
+        try:
+            if ticket.position:
+                for i in contexts:
+                    if i is not None:
+                        await i.send(self.QUEUE_MESSAGE.format(ticket.position))
+            await ticket.wait()
+
+            # See if someone else rendered the same tree while we were waiting
+            if render_cache is not None:
+                image_data = render_cache.get(cache_key, output_format)
+                if image_data is not None:
+                    return image_data
+
+            # Convert to an image
+            dot = await asyncio.create_subprocess_exec(
+                'dot', f'-T{output_format}', *self.RENDER_OPTIONS,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, loop=self.bot.loop,
+                preexec_fn=(lambda: os.nice(niceness)) if niceness else None,
+            )
+            try:
+                image_data, error_data = await asyncio.wait_for(dot.communicate(dot_code.encode()), 10.0, loop=self.bot.loop)
+            except asyncio.TimeoutError:
+                self.log_handler.error(f"Graphviz timed out rendering tree {cache_key}")
+                raise utils.errors.TreeRenderFailed("Your tree took too long to render - try `neighbourhoodtree` for a smaller one.")
+            finally:
+                # Kill subprocess
+                try:
+                    dot.kill()
+                except ProcessLookupError:
+                    pass  # It already died
+                except Exception as e:
+                    raise e
+        finally:
+            ticket.release()
+
+        # Make sure it actually rendered, so a broken image never gets cached
+        if dot.returncode != 0 or not image_data:
+            self.log_handler.error(f"Graphviz failed to render tree {cache_key} (return code {dot.returncode}) - {error_data.decode(errors='replace').strip()}")
+            raise utils.errors.TreeRenderFailed("Something went wrong rendering your tree - please try again later.")
+
+        # Save it for next time
+        if render_cache is not None:
+            try:
+                render_cache.save(cache_key, 'gz', dot_code.encode())
+                render_cache.save(cache_key, output_format, image_data)
+            except OSError as e:
+                self.log_handler.error(f"Could not save tree {cache_key} to {render_cache.directory} - {e}")
+        return image_data
+
+    async def treemaker(self, ctx:utils.Context, root_user_id:int, all_guilds:bool=False, stupid_tree:bool=False, image_format:str=None, generations:int=None):
         """Handles the generation and sending of the tree to the user"""
 
         # Get their family tree
@@ -198,51 +306,108 @@ class Information(utils.Cog):
             username = await self.bot.get_name(root_user_id)
             return await ctx.send(f"`{username}` has no family to put into a tree .-.")
 
-        # Write their treemaker code to a file
+        # Let the prerenderer know which trees people are looking at
+        if all_guilds and not stupid_tree and generations is None and image_format is None:
+            self.bot.dispatch('tree_command', ctx, root_user_id)
+
+        # Share the render with anyone else asking for the same tree right now
         start_time = dt.now()
         async with self.bot.database() as db:
             ctu = await utils.CustomisedTreeUser.get(ctx.author.id, db)
-        async with ctx.channel.typing():
-            if stupid_tree:
-                dot_code = await tree.to_full_dot_script(self.bot, ctu)
-            else:
-                dot_code = await tree.to_dot_script(self.bot, None if all_guilds else ctx.guild, ctu)
-
-        try:
-            with open(f'{self.bot.config["tree_file_location"]}/{ctx.author.id}.gz', 'w', encoding='utf-8') as a:
-                a.write(dot_code)
-        except Exception as e:
-            self.log_handler.error(f"Could not write to {self.bot.config['tree_file_location']}/{ctx.author.id}.gz")
-            raise e
-
-        # Convert to an image
-        dot = await asyncio.create_subprocess_exec(*[
-            'dot',
-            '-Tpng',
-            f'{self.bot.config["tree_file_location"].rstrip("/")}/{ctx.author.id}.gz',
-            '-o',
-            f'{self.bot.config["tree_file_location"].rstrip("/")}/{ctx.author.id}.png',
-            '-Gcharset=UTF-8',
-            ], loop=self.bot.loop
+        guild = None if all_guilds else ctx.guild
+        max_size = ctx.guild.filesize_limit if ctx.guild else 8 * 2 ** 20
+        key = (tree.id, tree._guild_id)
+        guild_key = (guild.id, utils.FamilyTreeMember.guild_members.version(guild.id)) if guild else None
+        render_key = (
+            key, utils.FamilyTreeMember.family_components.version(key), guild_key,
+            stupid_tree, generations, tuple(ctu.hex.values()), image_format, max_size,
         )
-        await asyncio.wait_for(dot.wait(), 10.0, loop=self.bot.loop)
-
-        # Kill subprocess
-        try:
-            dot.kill()
-        except ProcessLookupError:
-            pass  # It already died
-        except Exception as e:
-            raise e
+        shared_render = self.in_flight_renders.get(render_key)
+        if shared_render is None:
+            shared_render = self.in_flight_renders[render_key] = utils.SharedRender()
+            shared_render.contexts.append(ctx)
+            shared_render.future = asyncio.ensure_future(self.make_tree_image(
+                ctx, tree, ctu, guild, stupid_tree, image_format, generations, max_size, shared_render
+            ))
+            shared_render.future.add_done_callback(lambda _: self.in_flight_renders.pop(render_key, None))
+            image_data, image_format, dot_code = await asyncio.shield(shared_render.future)
+        else:
+            self.coalesced_renders += 1
+            image_data, image_format, dot_code = await self.wait_for_shared_render(ctx, shared_render)
 
         # Get time taken
         end_time = dt.now()
         time_taken = (end_time - start_time).total_seconds()
 
-        # Send file and delete cached
-        file = discord.File(fp=f'{self.bot.config["tree_file_location"]}/{ctx.author.id}.png')
+        # Send file
+        file = discord.File(fp=io.BytesIO(image_data), filename=f'{ctx.author.id}.{utils.TreeImageEncoder.FORMATS[image_format]}')
+        if dot_code is None:
+            return await ctx.send(f"[Click here](https://marriagebot.xyz/) to customise your tree. Generated in `{time_taken:.2f}` seconds.", file=file)
         await ctx.send(f"[Click here](https://marriagebot.xyz/) to customise your tree. Generated in `{time_taken:.2f}` seconds from `{len(dot_code)}` bytes of DOT code.", file=file)
 
+    async def wait_for_shared_render(self, ctx:utils.Context, shared_render:utils.SharedRender) -> typing.Tuple[bytes, str, typing.Optional[str]]:
+        """Waits for a render that another tree command started, making sure it's queued at least
+        as high as the author's priority and telling them where it is in the queue"""
+
+        if shared_render.ticket is None or shared_render.ticket.position:
+            shared_render.add_priority(await self.get_render_priority(ctx))
+        if shared_render.ticket is None:
+            shared_render.contexts.append(ctx)  # They'll be told its place in the queue when it joins
+        elif shared_render.ticket.position:
+            await ctx.send(self.QUEUE_MESSAGE.format(shared_render.ticket.position))
+            return await asyncio.shield(shared_render.future)
+        async with ctx.channel.typing():
+            return await asyncio.shield(shared_render.future)
+
+    async def make_tree_image(self, ctx:utils.Context, tree:utils.FamilyTreeMember, ctu:utils.CustomisedTreeUser, guild:discord.Guild, stupid_tree:bool, image_format:typing.Optional[str], generations:typing.Optional[int], max_size:int, shared_render:utils.SharedRender=None) -> typing.Tuple[bytes, str, typing.Optional[str]]:
+        """Generates and renders a tree image, giving back (image data, image format, DOT code) - the
+        DOT code is None if it was drawn without Graphviz"""
+
+        # Draw small trees ourselves rather than starting up Graphviz
+        output_format = 'svg' if image_format == 'svg' else 'png'
+        dot_code = None
+        image_data = None
+        native_renderer = self.bot.native_tree_renderer
+        if native_renderer is not None and generations is None and native_renderer.can_render(tree, ctu):
+            gen_span = tree.get_tree_generational_span(guild, full=stupid_tree)
+            tree.add_partner_and_parent(gen_span)
+            names = await tree.get_generational_span_names(self.bot, gen_span)
+            if not native_renderer.can_draw(names.values()):
+                pass  # Graphviz can fall back to other fonts for them
+            elif output_format == 'svg':
+                image_data = native_renderer.render_svg(tree, gen_span, ctu.hex, names).encode()
+            else:
+                image_data = native_renderer.render_png(tree, gen_span, ctu.hex, names)
+
+        # Generate their treemaker code
+        if image_data is None:
+            async with ctx.channel.typing():
+                if stupid_tree:
+                    dot_code = await tree.to_full_dot_script(self.bot, ctu)
+                elif generations is not None:
+                    dot_code = await tree.to_neighbourhood_dot_script(self.bot, generations, guild, ctu)
+                else:
+                    dot_code = await tree.to_dot_script(self.bot, guild, ctu)
+
+            # Render it, if it hasn't been already
+            cache_key = utils.RenderCache.get_key(dot_code, f'-T{output_format}', *self.RENDER_OPTIONS)
+            if self.bot.render_cache is not None:
+                image_data = self.bot.render_cache.get(cache_key, output_format)
+            if image_data is None:
+                image_data = await self.render_tree(ctx, dot_code, cache_key, output_format, shared_render=shared_render)
+
+        # Convert it to the right format, making sure it's small enough to upload
+        if output_format == 'svg':
+            if len(image_data) > max_size:
+                # SVGs can't be downscaled, so let the encoder pick whichever raster format comes out smallest
+                return await self.make_tree_image(ctx, tree, ctu, guild, stupid_tree, None, generations, max_size, shared_render)
+            self.bot.tree_image_encoder.record('svg', len(image_data), 0.0)
+            return image_data, 'svg', dot_code
+        image_data, image_format = await self.bot.loop.run_in_executor(
+            None, self.bot.tree_image_encoder.convert, image_data, image_format, max_size
+        )
+        return image_data, image_format, dot_code
+
 
 def setup(bot:utils.CustomBot):
     x = Information(bot)
@@ -32,9 +32,7 @@ class Marriage(utils.Cog):
             return await ctx.send(text_processor.target_is_unqualified())
 
         # See if they're already related
-        async with ctx.channel.typing():
-            relation = instigator_tree.get_relation(target_tree)
-        if relation and not self.bot.allows_incest(ctx.guild.id):
+        if instigator_tree.is_related(target_tree) and not self.bot.allows_incest(ctx.guild.id):
             return await ctx.send(text_processor.target_is_family())
 
         # Check the size of their trees
@@ -65,8 +63,7 @@ class Marriage(utils.Cog):
         await ctx.send(text_processor.request_accepted(), ignore_error=True)
 
         # Cache values locally
-        instigator_tree._partner = target.id
-        target_tree._partner = instigator.id
+        instigator_tree.add_partner(target_tree)
 
         # Ping em off over redis
         async with self.bot.redis() as re:
@@ -108,8 +105,7 @@ class Marriage(utils.Cog):
         await ctx.send(text_processor.valid_target())
 
         # Remove from cache
-        instigator_tree._partner = None
-        target_tree._partner = None
+        instigator_tree.remove_partner()
 
         # Ping over redis
         async with self.bot.redis() as re:
@@ -159,6 +159,12 @@ class Misc(utils.Cog):
         ]
         embed.add_field(name="Uptime", value=f"{uptime[0]} days, {uptime[1]} hours, {uptime[2]} minutes, and {uptime[3]:.2f} seconds.")
         # embed.add_field(name="Family Members", value=len(FamilyTreeMember.all_users) - 1)
+        embed.add_field(name="Reclaimed Family Members", value=f"{utils.FamilyTreeMember.reclaimed_members} ({utils.FamilyTreeMember.reclaimed_bytes/2**20:.2f}MB)")
+        render_queue = self.bot.render_queue
+        shared_renders = getattr(self.bot.get_cog('Information'), 'coalesced_renders', 0)
+        embed.add_field(name="Tree Render Queue", value=f"{render_queue.depth} waiting, {render_queue.running}/{render_queue.workers} rendering ({render_queue.average_wait_time:.2f}s average wait, {render_queue.max_wait_time:.2f}s max, {render_queue.total_rejected} turned away, {shared_renders} shared)")
+        image_stats = ", ".join(f"{image_format} {count} ({size / count / 2**10:.0f}KB, {encode_time / count * 1000:.0f}ms)" for image_format, (count, size, encode_time) in self.bot.tree_image_encoder.stats.items())
+        embed.add_field(name="Tree Images", value=f"{image_stats or 'None yet'} - {self.bot.tree_image_encoder.downscaled} downscaled")
         try:
             await ctx.send(embed=embed)
         except Exception:
@@ -31,9 +31,7 @@ class Parentage(utils.Cog):
             return await ctx.send(text_processor.instigator_is_unqualified())
 
         # See if they're already related
-        async with ctx.channel.typing():
-            relation = instigator_tree.get_relation(target_tree)
-        if relation and not self.bot.allows_incest(ctx.guild.id):
+        if instigator_tree.is_related(target_tree) and not self.bot.allows_incest(ctx.guild.id):
             return await ctx.send(text_processor.target_is_family())
 
         # Manage children
@@ -76,8 +74,7 @@ class Parentage(utils.Cog):
         await ctx.send(text_processor.request_accepted(), ignore_error=True)
 
         # Cache
-        instigator_tree._parent = target.id
-        target_tree._children.append(instigator.id)
+        target_tree.add_child(instigator_tree)
 
         # Ping em off over redis
         async with self.bot.redis() as re:
@@ -114,9 +111,7 @@ class Parentage(utils.Cog):
             return await ctx.send(text_processor.target_is_bot())
 
         # See if they're already related
-        async with ctx.channel.typing():
-            relation = instigator_tree.get_relation(target_tree)
-        if relation and not self.bot.allows_incest(ctx.guild.id):
+        if instigator_tree.is_related(target_tree) and not self.bot.allows_incest(ctx.guild.id):
             return await ctx.send(text_processor.target_is_family())
 
         # Manage children
@@ -159,8 +154,7 @@ class Parentage(utils.Cog):
             await db('INSERT INTO parents (parent_id, child_id, guild_id, timestamp) VALUES ($1, $2, $3, $4)', instigator.id, target.id, ctx.family_guild_id, dt.utcnow())
 
         # Add family caching
-        instigator_tree._children.append(target.id)
-        target_tree._parent = instigator_tree.id
+        instigator_tree.add_child(target_tree)
 
         # Ping em off over redis
         async with self.bot.redis() as re:
@@ -198,8 +192,7 @@ class Parentage(utils.Cog):
         await ctx.send(text_processor.valid_target(), ignore_error=True)
 
         # Remove family caching
-        instigator_tree._children.remove(target_tree.id)
-        target_tree._parent = None
+        instigator_tree.remove_child(target_tree)
 
         # Ping em off over redis
         async with self.bot.redis() as re:
@@ -227,8 +220,7 @@ class Parentage(utils.Cog):
         target_tree = instigator_tree.parent
 
         # Remove family caching
-        instigator_tree._parent = None
-        target_tree._children.remove(instigator.id)
+        target_tree.remove_child(instigator_tree)
 
         # Ping em off over redis
         async with self.bot.redis() as re:
@@ -254,8 +246,7 @@ class Parentage(utils.Cog):
 
         # Disown em
         for child in children:
-            child._parent = None
-        user_tree._children = []
+            user_tree.remove_child(child)
 
         # Save em
         async with self.bot.database() as db:
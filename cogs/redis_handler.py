@@ -33,7 +33,8 @@ class RedisHandler(utils.Cog):
         ]
         # if not self.bot.is_server_specific:
         self.handlers.extend([
-            task(self.channel_handler('TreeMemberUpdate', lambda data: utils.FamilyTreeMember(**data))),
+            task(self.channel_handler('TreeMemberUpdate', self.update_tree_member)),
+            task(self.channel_handler('UserNameUpdate', self.update_user_name)),
         ])
 
     def cog_unload(self):
@@ -129,6 +130,26 @@ class RedisHandler(utils.Cog):
             return
         self.bot.guild_settings[data['guild_id']]['max_children'] = prefix
 
+    def update_tree_member(self, data):
+        """Updates a family tree member from another shard"""
+
+        if self.bot.is_server_specific and not self.bot.is_local_guild(data.get('guild_id', 0)):
+            return  # That guild's families are looked after by another shard cluster
+        if utils.FamilyTreeMember.lazy_loader is not None:
+            utils.FamilyTreeMember.lazy_loader.apply_update(data)
+        else:
+            utils.FamilyTreeMember(**data)
+        self.bot.dispatch('tree_member_update', data)
+
+    def update_user_name(self, data):
+        """Bumps the version of a user's families after they change their name, so that any cached
+        trees with their old name in them get regenerated"""
+
+        utils.FamilyTreeMember.family_components.touch((data['user_id'], 0))
+        if self.bot.is_server_specific:
+            for guild in self.bot.guilds:
+                utils.FamilyTreeMember.family_components.touch((data['user_id'], guild.id))
+
     async def send_user_message(self, data):
         """Sends a message to a given user"""
 
@@ -19,6 +19,16 @@ class ServerSpecific(utils.Cog):
             if not data:
                 self.log_handler.warn(f"Automatically left guild {guild.name} ({guild.id}) for non-subscription")
                 await guild.leave()
+                return
+        await self.bot.load_guild_family(guild.id)
+
+    @utils.Cog.listener()
+    async def on_guild_remove(self, guild:discord.Guild):
+        """Removes the guild's families from memory when the bot leaves it"""
+
+        if not self.bot.is_server_specific:
+            return
+        self.bot.unload_guild_family(guild.id)
 
     @commands.command()
     @utils.checks.is_server_specific_bot_moderator()
@@ -295,9 +295,7 @@ class Simulation(utils.Cog):
         # Check if they are related
         x = utils.FamilyTreeMember.get(ctx.author.id)
         y = utils.FamilyTreeMember.get(user.id)
-        async with ctx.channel.typing():
-            relationship = x.get_relation(y)
-        if relationship == None or relationship.casefold() == 'partner':
+        if not x.is_related(y) or x._partner == y.id:
             pass
         elif not self.bot.allows_incest(ctx.guild.id):
             pass
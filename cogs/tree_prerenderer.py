@@ -0,0 +1,144 @@
+import collections
+import resource
+import time
+import typing
+
+from discord.ext import tasks
+
+from cogs import utils
+
+
+class TreePrerenderer(utils.Cog):
+    """Renders the trees of families that have just changed in the background, so that they're
+    already in the render cache by the time someone runs the tree command for them
+
+    Only trees that have been asked for recently are rendered, and only while the render queue is
+    quiet and the prerenderer is within its CPU budget. Only the CPU time of the Graphviz processes
+    counts towards the budget, as the rest of the work is mostly waiting on the database and the queue"""
+
+    PRIORITY = 100  # Below everyone running the tree command
+    NICENESS = 10  # Makes the OS give the Graphviz processes less CPU time
+    HISTORY_SIZE = 1000  # How many recent tree commands to remember
+    HISTORY_TIME = 60 * 60  # How long (in seconds) a tree command is remembered for
+    BUDGET_WINDOW = 60  # How often (in seconds) the CPU budget resets
+
+    def __init__(self, bot:utils.CustomBot):
+        super().__init__(bot)
+        self.cpu_budget = bot.config.get('prerender_cpu_budget', 0.1)
+        self.recent_trees: typing.Dict[typing.Tuple[int, int, int], float] = collections.OrderedDict()  # (author ID, root user ID, guild ID): when they asked for it
+        self.pending: typing.Dict[typing.Tuple[int, int, int], None] = collections.OrderedDict()  # Trees that need rendering, oldest first
+        self.budget_window_start = time.monotonic()
+        self.busy_time = 0.0
+        self.prerendered = 0
+        if bot.config.get('prerender_trees') and bot.render_cache is not None:
+            self.prerender_loop.start()
+
+    def cog_unload(self):
+        self.prerender_loop.cancel()
+
+    @utils.Cog.listener()
+    async def on_tree_command(self, ctx:utils.Context, root_user_id:int):
+        """Remembers who's been looking at which tree"""
+
+        key = (ctx.author.id, root_user_id, ctx.family_guild_id)
+        self.recent_trees.pop(key, None)
+        self.recent_trees[key] = time.monotonic()
+        while len(self.recent_trees) > self.HISTORY_SIZE:
+            self.recent_trees.popitem(last=False)
+
+    @utils.Cog.listener()
+    async def on_tree_member_update(self, data:dict):
+        """Queues up any recently looked at trees that are in the same family as the updated user"""
+
+        # Forget about old tree commands
+        now = time.monotonic()
+        while self.recent_trees and now - next(iter(self.recent_trees.values())) > self.HISTORY_TIME:
+            self.recent_trees.popitem(last=False)
+
+        # See which trees have changed
+        family_components = utils.FamilyTreeMember.family_components
+        updated_key = (data['discord_id'], data.get('guild_id', 0))
+        for key in self.recent_trees:
+            _, root_user_id, guild_id = key
+            if guild_id == updated_key[1] and family_components.same_component((root_user_id, guild_id), updated_key):
+                self.pending.pop(key, None)
+                self.pending[key] = None
+
+    @tasks.loop(seconds=2)
+    async def prerender_loop(self):
+        """Renders the next pending tree, if there's time to"""
+
+        if not self.bot.is_ready() or not self.pending:
+            return
+
+        # Stay within the CPU budget
+        now = time.monotonic()
+        if now - self.budget_window_start >= self.BUDGET_WINDOW:
+            self.budget_window_start = now
+            self.busy_time = 0.0
+        if self.busy_time >= self.cpu_budget * self.BUDGET_WINDOW:
+            return
+
+        # Don't get in the way of anyone running the tree command
+        render_queue = self.bot.render_queue
+        if render_queue.depth or render_queue.running >= render_queue.workers - 1:
+            return
+
+        # Render the tree
+        (author_id, root_user_id, guild_id), _ = self.pending.popitem(last=False)
+        start_time = self.get_child_cpu_time()
+        try:
+            await self.prerender(author_id, root_user_id, guild_id)
+        except Exception as e:
+            self.log_handler.error(f"Could not prerender tree of {root_user_id} for {author_id} - {e}")
+        finally:
+            self.busy_time += self.get_child_cpu_time() - start_time
+
+    @staticmethod
+    def get_child_cpu_time() -> float:
+        """Gives you how much CPU time (in seconds) the bot's finished subprocesses have used
+        This includes any tree command renders that finished at the same time, so the budget errs on
+        the side of rendering less"""
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    async def prerender(self, author_id:int, root_user_id:int, guild_id:int) -> None:
+        """Renders a tree into the render cache, as the tree command would"""
+
+        information = self.bot.get_cog('Information')
+        if information is None:
+            return
+        pinned_keys = await self.bot.load_families([(root_user_id, guild_id)])
+        try:
+            await self.prerender_loaded(information, author_id, root_user_id, guild_id)
+        finally:
+            self.bot.unpin_families(pinned_keys)
+
+    async def prerender_loaded(self, information:utils.Cog, author_id:int, root_user_id:int, guild_id:int) -> None:
+        """Renders a tree into the render cache, once its family has been loaded"""
+
+        tree = utils.FamilyTreeMember.get(root_user_id, guild_id)
+        if tree.is_empty:
+            return
+        async with self.bot.database() as db:
+            ctu = await utils.CustomisedTreeUser.get(author_id, db)
+        native_renderer = self.bot.native_tree_renderer
+        if native_renderer is not None and native_renderer.can_render(tree, ctu):
+            gen_span = tree.get_tree_generational_span(None, full=False)
+            tree.add_partner_and_parent(gen_span)
+            if native_renderer.can_draw((await tree.get_generational_span_names(self.bot, gen_span)).values()):
+                return  # These are quick enough to do when they're asked for
+
+        # See if it's been rendered already
+        dot_code = await tree.to_dot_script(self.bot, None, ctu)
+        cache_key = utils.RenderCache.get_key(dot_code, '-Tpng', *information.RENDER_OPTIONS)
+        if cache_key in self.bot.render_cache:
+            return
+        await information.render_tree(None, dot_code, cache_key, priority=self.PRIORITY, niceness=self.NICENESS)
+        self.prerendered += 1
+
+
+def setup(bot:utils.CustomBot):
+    x = TreePrerenderer(bot)
+    bot.add_cog(x)
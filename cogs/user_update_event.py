@@ -14,6 +14,9 @@ class UserUpdateEvent(utils.Cog):
         async with self.bot.redis() as re:
             await re.set(f'UserName-{after.id}', str(after))
 
+            # Their name is in any cached trees, so make sure every shard regenerates those
+            await re.publish_json('UserNameUpdate', {'user_id': after.id})
+
 
 def setup(bot:utils.CustomBot):
     x = UserUpdateEvent(bot)
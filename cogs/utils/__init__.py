@@ -8,8 +8,20 @@ from cogs.utils.acceptance_check import AcceptanceCheck
 
 from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
 from cogs.utils.family_tree.relation_simplifier import Simplifier
+from cogs.utils.family_tree.family_component_index import FamilyComponentIndex
+from cogs.utils.family_tree.compact_family_store import CompactFamilyStore, CompactFamilyTreeMember
+from cogs.utils.family_tree.tree_cache import TreeCache
+from cogs.utils.family_tree.ancestor_index import AncestorIndex
+from cogs.utils.family_tree.guild_member_index import GuildMemberIndex
+from cogs.utils.family_tree.family_worker_pool import FamilyWorkerPool
+from cogs.utils.family_tree.family_snapshot_file import FamilySnapshotFile
+from cogs.utils.family_tree.lazy_family_loader import LazyFamilyLoader
+from cogs.utils.family_tree.native_tree_renderer import NativeTreeRenderer
 
 from cogs.utils.customised_tree_user import CustomisedTreeUser
+from cogs.utils.render_queue import RenderQueue, RenderTicket, SharedRender
+from cogs.utils.render_cache import RenderCache
+from cogs.utils.tree_image_encoder import TreeImageEncoder
 from cogs.utils.custom_context import CustomContext as Context
 from cogs.utils.custom_cog import Cog
 
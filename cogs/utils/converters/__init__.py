@@ -1,2 +1,4 @@
 from cogs.utils.converters.user_block import BlockedUserError, UnblockedMember
+from cogs.utils.converters.generation_count import GenerationCount
 from cogs.utils.converters.user_id import UserID
+from cogs.utils.converters.tree_image_format import TreeImageFormat
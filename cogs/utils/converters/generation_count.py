@@ -0,0 +1,19 @@
+from discord.ext import commands
+
+
+class GenerationCount(commands.Converter):
+    """A converter that makes sure the given value is a sensible amount of generations for a tree
+    Returns the amount as an int"""
+
+    MAX_GENERATIONS = 10
+
+    async def convert(self, ctx:commands.Context, value:str) -> int:
+        """Converts the given value to an amount of generations"""
+
+        try:
+            generations = int(value)
+        except ValueError:
+            raise commands.BadArgument(f"\"{value}\" isn't a number of generations")
+        if not 1 <= generations <= self.MAX_GENERATIONS:
+            raise commands.BadArgument(f"The number of generations needs to be between 1 and {self.MAX_GENERATIONS}")
+        return generations
@@ -0,0 +1,16 @@
+from discord.ext import commands
+
+from cogs.utils.tree_image_encoder import TreeImageEncoder
+
+
+class TreeImageFormat(commands.Converter):
+    """A converter that makes sure the given value is one of the formats a tree can be sent as
+    Returns the format name"""
+
+    async def convert(self, ctx:commands.Context, value:str) -> str:
+        """Converts the given value to a valid tree image format"""
+
+        value = value.lower().lstrip('.')
+        if value not in TreeImageEncoder.FORMATS:
+            raise commands.BadArgument(f"Tree format \"{value}\" not found - use one of {', '.join(TreeImageEncoder.FORMATS)}")
+        return value
@@ -1,6 +1,7 @@
 from datetime import datetime as dt
 import asyncio
 import glob
+import inspect
 import re as regex
 import logging
 from urllib.parse import urlencode
@@ -46,6 +47,7 @@ class CustomBot(commands.AutoShardedBot):
         'max_family_members': None,  # Set in init; only used in gold
         'max_children': {},  # RoleID: ChildAmount; only used in gold
     }
+    FAMILY_COGS = ('Marriage', 'Parentage', 'Information', 'Simulation', 'ModeratorOnly')  # The cogs whose commands use the family tree
 
     def __init__(self, *args, config_file:str, logger:logging.Logger=None, **kwargs):
         super().__init__(command_prefix=get_prefix, *args, **kwargs)
@@ -86,6 +88,25 @@ class CustomBot(commands.AutoShardedBot):
         self.guild_settings: typing.Dict[int, dict] = collections.defaultdict(lambda: self.DEFAULT_GUILD_SETTINGS.copy())
         self.dbl_votes: typing.Dict[int, dt] = {}
 
+        # Pick how the family tree is stored
+        if self.config.get('lazy_family_loading'):
+            utils.FamilyTreeMember.lazy_loader = utils.LazyFamilyLoader(self.config.get('lazy_family_max_users', 250000))
+            self.before_invoke(self.load_command_families)
+            self.after_invoke(self.unpin_command_families)
+        elif self.config.get('compact_family_store'):
+            utils.FamilyTreeMember.all_users = utils.CompactFamilyStore()
+        utils.FamilyTreeMember.tree_cache.max_size = self.config.get('tree_cache_size', utils.FamilyTreeMember.tree_cache.max_size)
+        if self.config.get('family_worker_processes'):
+            utils.FamilyTreeMember.worker_pool = utils.FamilyWorkerPool(self.config['family_worker_processes'], self.config.get('family_worker_threshold', 2500))
+        self.render_queue = utils.RenderQueue(self.config.get('render_workers') or None, self.config.get('render_queue_size', 50))
+        self.native_tree_renderer = None
+        if self.config.get('native_render_max_size'):
+            self.native_tree_renderer = utils.NativeTreeRenderer(self.config['native_render_max_size'], self.config.get('native_render_font') or None)
+        self.tree_image_encoder = utils.TreeImageEncoder(self.config.get('tree_image_auto_threshold', 2) * 2 ** 20)
+        self.render_cache = None
+        if self.config.get('save_tree_files', True):
+            self.render_cache = utils.RenderCache(self.config['tree_file_location'], self.config.get('render_cache_size', 500) * 2 ** 20)
+
         # Put the bot object in some other classes
         utils.ProposalCache.bot = self
         utils.random_text.RandomText.original.bot = self
@@ -126,6 +147,45 @@ class CustomBot(commands.AutoShardedBot):
 
         return self.config['server_specific']
 
+    def get_shard_filter(self) -> str:
+        """Gives you an SQL clause that picks out only the guilds that are on this shard cluster"""
+
+        if self.shard_ids is None:
+            return 'TRUE'
+        return f"(guild_id >> 22) % {int(self.shard_count)}=ANY(ARRAY[{', '.join(str(int(i)) for i in self.shard_ids)}]::INTEGER[])"
+
+    def is_local_guild(self, guild_id:int) -> bool:
+        """Whether or not the given guild is on this shard cluster"""
+
+        if self.shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def load_guild_family(self, guild_id:int) -> None:
+        """Loads all of the families for a given guild into the tree, for server specific families"""
+
+        if utils.FamilyTreeMember.lazy_loader is not None:
+            return  # They'll be loaded when they're needed
+        async with self.database() as db:
+            partnerships = await db('SELECT * FROM marriages WHERE guild_id=$1', guild_id)
+            parents = await db('SELECT * FROM parents WHERE guild_id=$1', guild_id)
+        self.logger.debug(f"Caching {len(partnerships)} partnerships and {len(parents)} parents/children for guild {guild_id}")
+        utils.FamilyTreeMember.add_relations(
+            [(i['user_id'], i['partner_id'], i['guild_id']) for i in partnerships],
+            [(i['parent_id'], i['child_id'], i['guild_id']) for i in parents],
+        )
+
+    def unload_guild_family(self, guild_id:int) -> None:
+        """Removes all of the families for a given guild from the tree, for server specific families"""
+
+        if utils.FamilyTreeMember.lazy_loader is not None:
+            for key in [i for i in utils.FamilyTreeMember.all_users.keys() if i[1] == guild_id]:
+                if key in utils.FamilyTreeMember.lazy_loader:
+                    utils.FamilyTreeMember.lazy_loader.evict(key)
+            return
+        self.logger.debug(f"Removing families for guild {guild_id}")
+        utils.FamilyTreeMember.remove_guild(guild_id)
+
     def allows_incest(self, guild:typing.Union[discord.Guild, int]) -> bool:
         """Returns if a given GUILD allows incest or not
 
@@ -145,6 +205,12 @@ class CustomBot(commands.AutoShardedBot):
         # Remove caches
         self.logger.debug("Clearing family tree member cache")
         utils.FamilyTreeMember.all_users.clear()
+        utils.FamilyTreeMember.family_components.clear()
+        utils.FamilyTreeMember.tree_cache.clear()
+        utils.FamilyTreeMember.ancestors.clear()
+        utils.FamilyTreeMember.guild_members.clear()
+        if utils.FamilyTreeMember.lazy_loader is not None:
+            utils.FamilyTreeMember.lazy_loader.clear()
         self.logger.debug("Clearing blacklisted guilds cache")
         self.blacklisted_guilds.clear()
         self.logger.debug("Clearing guild settings cache")
@@ -156,44 +222,99 @@ class CustomBot(commands.AutoShardedBot):
         self.logger.debug("Clearing random text cache")
         utils.random_text.RandomText.original.all_random_text.clear()
 
-        # Grab a database connection
-        db: utils.DatabaseConnection = await self.database.get_connection()
+        # Load everything from the database at once, each over its own connection
+        start_time = dt.now()
+        if utils.FamilyTreeMember.lazy_loader is None:
+            family_load = self.loop.create_task(self.run_startup_phase("family tree", self.load_family_tree))
+        else:
+            self.logger.debug("Not loading family tree, since families are loaded lazily")
+            family_load = asyncio.sleep(0)
+        await asyncio.gather(
+            self.run_startup_phase("random text", self.load_random_text),
+            self.run_startup_phase("blacklisted guilds", self.load_blacklisted_guilds),
+            self.run_startup_phase("blocked users", self.load_blocked_users),
+            self.run_startup_phase("guild settings", self.load_guild_settings),
+            self.run_startup_phase("DBL votes", self.load_dbl_votes),
+        )
+
+        # Wait for the bot to cache users before continuing
+        self.logger.debug("Waiting until ready before completing startup method.")
+        await self.wait_until_ready()
+
+        # Look through and find what servers the bot is allowed to be on, if server specific
+        if self.is_server_specific:
+            try:
+                async with self.database() as db:
+                    allowed_guilds = await db('SELECT guild_id FROM guild_specific_families')
+            except Exception as e:
+                self.logger.critical(f"Ran into an error selecting server specific guilds: {e}")
+                exit(1)
+            allowed_guild_ids = [i['guild_id'] for i in allowed_guilds]
+            current_guild_ids = self._connection._guilds.keys()
+            guild_ids_to_leave = [i for i in current_guild_ids if i not in allowed_guild_ids]
+            for guild_id in guild_ids_to_leave:
+                guild = self.get_guild(guild_id)
+                self.logger.warn(f"Automatically left guild {guild.name} ({guild.id}) for non-subscription")
+                await guild.leave()
+
+        # Make sure the family tree is in
+        await family_load
+        self.logger.info(f"Loaded everything from the database in {(dt.now() - start_time).total_seconds():.2f} seconds")
 
-        # Load in all of the random text
+        # Save all available names to redis
+        async with self.redis() as re:
+            for user in self.users:
+                await re.set(f'UserName-{user.id}', str(user))
+
+        # And update DBL
+        await self.post_guild_count()
+
+    async def run_startup_phase(self, name:str, method:typing.Callable[[utils.DatabaseConnection], typing.Awaitable[None]]) -> None:
+        """Runs part of the startup method with its own database connection, logging how long it took
+
+        Params:
+            name: str
+                What's being loaded, for the logs
+            method: callable
+                A coroutine function taking a database connection, which loads the data
+        """
+
+        start_time = dt.now()
         try:
-            random_text = await db('SELECT * FROM random_text')
+            async with self.database() as db:
+                await method(db)
         except Exception as e:
-            self.logger.critical(f"Ran into an errorr selecting random text: {e}")
+            self.logger.critical(f"Ran into an error loading {name}: {e}")
             exit(1)
+        self.logger.info(f"Loaded {name} in {(dt.now() - start_time).total_seconds():.2f} seconds")
+
+    async def load_random_text(self, db:utils.DatabaseConnection) -> None:
+        """Loads in all of the random text"""
+
+        random_text = await db('SELECT * FROM random_text')
         self.logger.debug(f"Caching {len(random_text)} lines of random text")
         for row in random_text:
             utils.random_text.RandomText.original.all_random_text[row['command_name']][row['event_name']].append(row['string'])
 
-        # Pick up the blacklisted guilds from the db
-        try:
-            blacklisted = await db('SELECT * FROM blacklisted_guilds')
-        except Exception as e:
-            self.logger.critical(f"Ran into an error selecting blacklisted guilds: {e}")
-            exit(1)
+    async def load_blacklisted_guilds(self, db:utils.DatabaseConnection) -> None:
+        """Picks up the blacklisted guilds from the db"""
+
+        blacklisted = await db('SELECT * FROM blacklisted_guilds')
         self.logger.debug(f"Caching {len(blacklisted)} blacklisted guilds")
         self.blacklisted_guilds = [i['guild_id'] for i in blacklisted]
 
-        # Pick up the blocked users
-        try:
-            blocked = await db('SELECT * FROM blocked_user')
-        except Exception as e:
-            self.logger.critical(f"Ran into an error selecting blocked users: {e}")
-            exit(1)
+    async def load_blocked_users(self, db:utils.DatabaseConnection) -> None:
+        """Picks up the blocked users"""
+
+        blocked = await db('SELECT * FROM blocked_user')
         self.logger.debug(f"Caching {len(blocked)} blocked users")
         for user in blocked:
             self.blocked_users[user['user_id']].append(user['blocked_user_id'])
 
-        # Grab the command prefixes per guild
-        try:
-            all_settings = await db('SELECT * FROM guild_settings WHERE (guild_id >> 22) % $1=ANY($2::INTEGER[])', self.shard_count, self.shard_ids)
-        except Exception as e:
-            self.logger.critical(f"Ran into an error selecting guild settings: {e}")
-            exit(1)
+    async def load_guild_settings(self, db:utils.DatabaseConnection) -> None:
+        """Grabs the command prefixes and max children amounts per guild"""
+
+        all_settings = await db('SELECT * FROM guild_settings WHERE (guild_id >> 22) % $1=ANY($2::INTEGER[])', self.shard_count, self.shard_ids)
         self.logger.debug(f"Caching {len(all_settings)} guild settings")
         for items in all_settings:
             current_settings = self.guild_settings[items['guild_id']]  # Get current (which should include defaults)
@@ -204,81 +325,181 @@ class CustomBot(commands.AutoShardedBot):
 
         # Grab the max children amount
         if self.is_server_specific:
-            try:
-                max_children_data = await db('SELECT * FROM max_children_amount WHERE (guild_id >> 22) % $1=ANY($2::INTEGER[])', self.shard_count, self.shard_ids)
-            except Exception as e:
-                self.logger.critical(f"Ran into an error selecting guild settings: {e}")
-                exit(1)
+            max_children_data = await db('SELECT * FROM max_children_amount WHERE (guild_id >> 22) % $1=ANY($2::INTEGER[])', self.shard_count, self.shard_ids)
             self.logger.debug(f"Caching {len(max_children_data)} max children settings")
             for row in max_children_data:
                 current_settings = self.guild_settings[row['guild_id']]  # Get current (which should include defaults)
                 current_settings['max_children'][row['role_id']] = row['amount']
                 self.guild_settings[row['guild_id']] = current_settings  # Cache
 
-        # Grab the last vote times of each user
-        try:
-            votes = await db("SELECT * FROM dbl_votes WHERE timestamp > NOW() - INTERVAL '12 hours'")
-        except Exception as e:
-            self.logger.critical(f"Ran into an error selecting DBL votes: {e}")
-            exit(1)
+    async def load_dbl_votes(self, db:utils.DatabaseConnection) -> None:
+        """Grabs the last vote times of each user"""
+
+        votes = await db("SELECT * FROM dbl_votes WHERE timestamp > NOW() - INTERVAL '12 hours'")
         self.logger.debug(f"Caching {len(votes)} DBL votes")
         for v in votes:
             self.dbl_votes[v['user_id']] = v['timestamp']
 
-        # Wait for the bot to cache users before continuing
-        self.logger.debug("Waiting until ready before completing startup method.")
-        await self.wait_until_ready()
+    async def load_family_tree(self, db:utils.DatabaseConnection) -> None:
+        """Loads the family tree - from the snapshot and then any newer rows in the database if we can,
+        or from just the database if we can't"""
 
-        # Look through and find what servers the bot is allowed to be on, if server specific
         if self.is_server_specific:
-            try:
-                allowed_guilds = await db('SELECT guild_id FROM guild_specific_families')
-            except Exception as e:
-                self.logger.critical(f"Ran into an error selecting server specific guilds: {e}")
-                exit(1)
-            allowed_guild_ids = [i['guild_id'] for i in allowed_guilds]
-            current_guild_ids = self._connection._guilds.keys()
-            guild_ids_to_leave = [i for i in current_guild_ids if i not in allowed_guild_ids]
-            for guild_id in guild_ids_to_leave:
-                guild = self.get_guild(guild_id)
-                self.logger.warn(f"Automatically left guild {guild.name} ({guild.id}) for non-subscription")
-                await guild.leave()
-
-        # Get family data from database
-        try:
-            if self.is_server_specific:
-                partnerships = await db('SELECT * FROM marriages WHERE guild_id<>0')
-                parents = await db('SELECT * FROM parents WHERE guild_id<>0')
+            family_filter = f'guild_id<>0 AND {self.get_shard_filter()}'
+            snapshot_location = f"{self.config.get('family_snapshot_location')}.{'-'.join(str(i) for i in sorted(self.shard_ids or []))}of{self.shard_count}"
+        else:
+            family_filter = 'guild_id=0'
+            snapshot_location = self.config.get('family_snapshot_location')
+        snapshot_file = utils.FamilySnapshotFile(snapshot_location) if self.config.get('family_snapshot_location') else None
+        snapshot = await self.loop.run_in_executor(None, snapshot_file.read, self.is_server_specific) if snapshot_file else None
+        new_high_water_mark = utils.FamilySnapshotFile.get_high_water_mark()
+        since = None
+        if snapshot and snapshot[0] < dt.utcnow() - utils.FamilySnapshotFile.DELETION_LOG_TIME + utils.FamilySnapshotFile.SAFETY_MARGIN:
+            self.logger.info("Family snapshot is older than the deletion log - loading the family tree from the database")
+            snapshot = None
+        if snapshot:
+            high_water_mark, partnerships, parents = snapshot
+
+            # Take out anything that's been divorced or disowned since it was saved
+            if not self.shard_ids or 0 in self.shard_ids:
+                await db('DELETE FROM family_deletions WHERE timestamp<$1', dt.utcnow() - utils.FamilySnapshotFile.DELETION_LOG_TIME)  # Only one shard needs to clear out the log
+            deletions = await db(f'SELECT table_name, user_id, other_id, guild_id FROM family_deletions WHERE {family_filter} AND timestamp>$1', high_water_mark)
+            if deletions:
+                self.logger.debug(f"Removing {len(deletions)} deleted rows from the family snapshot")
+                partnerships = utils.FamilySnapshotFile.remove_deleted(partnerships, [(i['user_id'], i['other_id'], i['guild_id']) for i in deletions if i['table_name'] == 'marriages'])
+                parents = utils.FamilySnapshotFile.remove_deleted(parents, [(i['user_id'], i['other_id'], i['guild_id']) for i in deletions if i['table_name'] == 'parents'])
+
+            # Make sure it matches the database
+            counts = await db(
+                f'''SELECT
+                (SELECT COUNT(*) FROM marriages WHERE {family_filter} AND (timestamp IS NULL OR timestamp<=$1)) AS marriages,
+                (SELECT COUNT(*) FROM parents WHERE {family_filter} AND (timestamp IS NULL OR timestamp<=$1)) AS parents''',
+                high_water_mark,
+            )
+            if (counts[0]['marriages'], counts[0]['parents']) == (len(partnerships), len(parents)):
+                self.logger.debug(f"Loaded {len(partnerships)} partnerships and {len(parents)} parents/children from the family snapshot")
+                since = high_water_mark
             else:
-                partnerships = await db('SELECT * FROM marriages WHERE guild_id=0')
-                parents = await db('SELECT * FROM parents WHERE guild_id=0')
-        except Exception as e:
-            self.logger.critical(f"Ran into an error selecting either marriages or parents: {e}")
-            exit(1)
+                self.logger.info("Family snapshot is out of date - loading the family tree from the database")
+        if since is None:
+            partnerships, parents = [], []
 
-        # Cache the family data - partners
-        self.logger.debug(f"Caching {len(partnerships)} partnerships from partnerships")
-        for i in partnerships:
-            utils.FamilyTreeMember(discord_id=i['user_id'], children=[], parent_id=None, partner_id=i['partner_id'], guild_id=i['guild_id'])
+        # Stream the marriages and parents in, one after the other so the startup phases don't use up the pool
+        new_partnerships = await self.fetch_family_rows(db, 'marriages', 'user_id, partner_id', family_filter, new_high_water_mark, since)
+        new_parents = await self.fetch_family_rows(db, 'parents', 'parent_id, child_id', family_filter, new_high_water_mark, since)
 
-        # - children
-        self.logger.debug(f"Caching {len(parents)} parents/children from parents")
-        for i in parents:
-            parent = utils.FamilyTreeMember.get(i['parent_id'], i['guild_id'])
-            parent._children.append(i['child_id'])
-            child = utils.FamilyTreeMember.get(i['child_id'], i['guild_id'])
-            child._parent = i['parent_id']
+        # Save a new snapshot with everything from before the new high-water mark
+        if snapshot_file:
+            try:
+                await self.loop.run_in_executor(
+                    None, snapshot_file.write, self.is_server_specific, new_high_water_mark,
+                    partnerships + [i[:3] for i in new_partnerships if i[3]],
+                    parents + [i[:3] for i in new_parents if i[3]],
+                )
+            except OSError as e:
+                self.logger.error(f"Could not write family snapshot to {snapshot_file.path}: {e}")
+        partnerships.extend(i[:3] for i in new_partnerships)
+        parents.extend(i[:3] for i in new_parents)
+
+        # Cache the family data into the compact store in one go
+        all_users = utils.FamilyTreeMember.all_users
+        if isinstance(all_users, utils.CompactFamilyStore):
+            self.logger.debug(f"Caching {len(partnerships)} partnerships and {len(parents)} parents/children into the compact family store")
+            all_users.load(partnerships, parents)
+            utils.FamilyTreeMember.family_components.rebuild(all_users.keys(), utils.FamilyTreeMember.get_neighbour_keys)
 
-        # Disconnect from the database
-        await db.disconnect()
+        # Cache the family data - partners
+        else:
+            self.logger.debug(f"Caching {len(partnerships)} partnerships from partnerships")
+            for user_id, partner_id, guild_id in partnerships:
+                utils.FamilyTreeMember(discord_id=user_id, children=[], parent_id=None, partner_id=partner_id, guild_id=guild_id)
+
+            # - children
+            self.logger.debug(f"Caching {len(parents)} parents/children from parents")
+            for parent_id, child_id, guild_id in parents:
+                parent = utils.FamilyTreeMember.get(parent_id, guild_id)
+                child = utils.FamilyTreeMember.get(child_id, guild_id)
+                parent.add_child(child)
+
+    async def load_command_families(self, ctx:commands.Context) -> None:
+        """Makes sure the families of the author and of any users given to a command are loaded,
+        and pins them so they aren't forgotten about while the command is still using them
+        Used as a before invoke hook when families are loaded lazily"""
+
+        if ctx.cog is None or ctx.cog.qualified_name not in self.FAMILY_COGS:
+            return
+        user_ids = {ctx.author.id}
+        params = ctx.command.clean_params
+        positional_count = sum(1 for i in params.values() if i.kind != inspect.Parameter.KEYWORD_ONLY)
+        positional_values = iter(ctx.args[len(ctx.args) - positional_count:])  # The converted arguments come after the cog and context
+        for name, param in params.items():
+            if param.kind == inspect.Parameter.KEYWORD_ONLY:
+                value = ctx.kwargs.get(name)
+            else:
+                value = next(positional_values, None)
+            converters = getattr(param.annotation, '__args__', None) or (param.annotation,)  # Looks inside typing.Optional
+            if isinstance(value, discord.abc.User):
+                user_ids.add(value.id)
+            elif isinstance(value, int) and utils.converters.UserID in converters:
+                user_ids.add(value)
+        guild_id = getattr(ctx, 'family_guild_id', 0)
+        ctx.pinned_family_keys = await self.load_families([(i, guild_id) for i in user_ids])
+
+    async def unpin_command_families(self, ctx:commands.Context) -> None:
+        """Lets the families pinned by load_command_families be forgotten about again
+        Used as an after invoke hook when families are loaded lazily"""
+
+        keys = getattr(ctx, 'pinned_family_keys', None)
+        if keys:
+            self.unpin_families(keys)
+            ctx.pinned_family_keys = None
+
+    async def load_families(self, keys:typing.List[typing.Tuple[int, int]]) -> typing.List[typing.Tuple[int, int]]:
+        """Makes sure the families of the given (discord_id, guild_id) keys are loaded and pins them,
+        giving back the keys that need to be given to unpin_families once you're done with them
+        Does nothing if families aren't loaded lazily"""
+
+        if utils.FamilyTreeMember.lazy_loader is None:
+            return []
+        await asyncio.gather(*[utils.FamilyTreeMember.lazy_loader.load(i) for i in keys])
+        utils.FamilyTreeMember.lazy_loader.pin(keys)
+        return keys
+
+    def unpin_families(self, keys:typing.List[typing.Tuple[int, int]]) -> None:
+        """Lets the families pinned by load_families be forgotten about again"""
+
+        if utils.FamilyTreeMember.lazy_loader is not None:
+            utils.FamilyTreeMember.lazy_loader.unpin(keys)
+
+    async def fetch_family_rows(self, db:utils.DatabaseConnection, table:str, columns:str, family_filter:str, high_water_mark:dt, since:dt=None) -> typing.List[typing.Tuple[int, int, int, bool]]:
+        """Streams rows from the marriages or parents table over a binary COPY
 
-        # Save all available names to redis
-        async with self.redis() as re:
-            for user in self.users:
-                await re.set(f'UserName-{user.id}', str(user))
+        Params:
+            db: DatabaseConnection
+                The connection to stream the rows over
+            table: str
+                The table to read from
+            columns: str
+                The two user ID columns to get from the table
+            family_filter: str
+                The WHERE clause picking which guilds' families to get
+            high_water_mark: datetime
+                Each row comes with whether or not it's from before this time
+            since: datetime = None
+                If given, only rows newer than this will be fetched
+
+        Returns:
+            A list of (user_id, user_id, guild_id, is_before_high_water_mark)
+        """
 
-        # And update DBL
-        await self.post_guild_count()
+        start_time = dt.now()
+        sql = f'SELECT {columns}, guild_id, (timestamp IS NULL OR timestamp<=$1) FROM {table} WHERE {family_filter}'
+        if since is None:
+            rows = await db.copy_fixed_width(sql, high_water_mark, columns='qqq?')
+        else:
+            rows = await db.copy_fixed_width(sql + ' AND timestamp>$2', high_water_mark, since, columns='qqq?')
+        self.logger.info(f"Streamed {len(rows)} rows from {table} in {(dt.now() - start_time).total_seconds():.2f} seconds")
+        return rows
 
     async def on_message(self, message:discord.Message):
         """Overriding the default on_message event to push my own context"""
@@ -440,5 +661,8 @@ class CustomBot(commands.AutoShardedBot):
 
         self.logger.debug("Closing aiohttp ClientSession")
         await asyncio.wait_for(self.session.close(), timeout=None)
+        if utils.FamilyTreeMember.worker_pool is not None:
+            self.logger.debug("Shutting down family worker pool")
+            utils.FamilyTreeMember.worker_pool.shutdown()
         self.logger.debug("Running original D.py logout method")
         await super().close(*args, **kwargs)
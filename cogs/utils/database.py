@@ -1,5 +1,6 @@
 import typing
 import logging
+import struct
 from datetime import datetime as dt
 
 import discord
@@ -80,6 +81,45 @@ class DatabaseConnection(object):
             return []
         return None
 
+    async def copy_fixed_width(self, sql:str, *args, columns:str) -> typing.List[tuple]:
+        """Runs a SELECT through a binary COPY, parsing the rows as they're streamed in
+        Only works for queries whose columns are all fixed width and never null (bigints, integers, booleans, etc)
+
+        Params:
+            sql: str
+                The SELECT query to be run
+            columns: str
+                The struct format character for each column, eg 'qq?' for two bigints and a boolean
+        """
+
+        self.logger.debug(f"Running SQL through binary COPY: {sql} {args!s}")
+        row_struct = struct.Struct('>h' + ''.join(f'i{i}' for i in columns))  # Field count, then (length, value) for each field
+        rows = []
+        buffer = bytearray()
+        header_read = False
+
+        async def output(data:bytes):
+            nonlocal header_read
+            buffer.extend(data)
+
+            # Skip the signature, flags, and header extension
+            if not header_read:
+                if len(buffer) < 19:
+                    return
+                extension_length, = struct.unpack_from('>i', buffer, 15)
+                if len(buffer) < 19 + extension_length:
+                    return
+                del buffer[:19 + extension_length]
+                header_read = True
+
+            # Parse every full row we've got, leaving any partial one (or the trailer) for later
+            row_count = len(buffer) // row_struct.size
+            rows.extend(i[2::2] for i in row_struct.iter_unpack(memoryview(buffer)[:row_count * row_struct.size]))
+            del buffer[:row_count * row_struct.size]
+
+        await self.conn.copy_from_query(sql, *args, output=output, format='binary')
+        return rows
+
     async def marry(self, instigator:typing.Union[int, discord.User], target:typing.Union[int, discord.User], guild_id:int):
         """Marries two given Discord users together"""
 
@@ -0,0 +1,142 @@
+import typing
+
+
+MemberKey = typing.Tuple[int, int]  # (discord_id, guild_id)
+
+
+class AncestorIndex(object):
+    """Keeps the depth of each user in their bloodline (how many parents they have above them) along
+    with a binary lifting table of their ancestors (their parent, grandparent, 4th ancestor, 8th, etc),
+    so that we can find the common ancestor of two users in logarithmic time
+
+    Everything is worked out lazily the first time it's asked for, and thrown away for a user
+    (and everyone below them) whenever their parent changes
+    """
+
+    __slots__ = ('_depths', '_jumps', '_dependents')
+
+    def __init__(self):
+        self._depths: typing.Dict[MemberKey, int] = {}
+        self._jumps: typing.Dict[MemberKey, typing.List[MemberKey]] = {}  # Key: [2^0th ancestor, 2^1st ancestor, ...]
+        self._dependents: typing.Dict[MemberKey, typing.Set[MemberKey]] = {}  # Key: keys whose cached data was worked out from this one
+
+    def clear(self) -> None:
+        """Removes everything from the index"""
+
+        self._depths.clear()
+        self._jumps.clear()
+        self._dependents.clear()
+
+    def invalidate(self, key:MemberKey) -> None:
+        """Throws away the cached data for the given user and everyone below them
+        Should be called whenever a user's parent changes"""
+
+        stack = [key]
+        while stack:
+            current = stack.pop()
+            if self._depths.pop(current, None) is None:
+                continue
+            jumps = self._jumps.pop(current)
+            if jumps:
+                self._dependents.get(jumps[0], set()).discard(current)
+            stack.extend(self._dependents.pop(current, ()))
+
+    def _ensure(self, key:MemberKey, parent_of:typing.Callable[[MemberKey], typing.Optional[MemberKey]]) -> None:
+        """Makes sure the depth and jump table for a given user are cached"""
+
+        if key in self._depths:
+            return
+
+        # Go up until we hit someone we already know about, or the top of the bloodline
+        path = []
+        seen = set()
+        current = key
+        while current is not None and current not in self._depths and current not in seen:
+            seen.add(current)
+            path.append(current)
+            current = parent_of(current)
+
+        # Fill in the table on the way back down
+        for current in reversed(path):
+            parent = parent_of(current)
+            if parent is None or parent not in self._depths:
+                self._depths[current] = 0  # Either the top of the line or a parent loop
+                self._jumps[current] = []
+                continue
+            self._depths[current] = self._depths[parent] + 1
+            jumps = [parent]
+            while len(self._jumps[jumps[-1]]) >= len(jumps):
+                jumps.append(self._jumps[jumps[-1]][len(jumps) - 1])
+            self._jumps[current] = jumps
+            self._dependents.setdefault(parent, set()).add(current)
+
+    def depth(self, key:MemberKey, parent_of:typing.Callable[[MemberKey], typing.Optional[MemberKey]]) -> int:
+        """Gives you how many generations of parents are above the given user
+
+        Params:
+            key: MemberKey
+                The (discord_id, guild_id) key of the user
+            parent_of: callable
+                A function returning the key of a given key's parent, or None
+        """
+
+        self._ensure(key, parent_of)
+        return self._depths[key]
+
+    def ancestor(self, key:MemberKey, generations:int, parent_of:typing.Callable[[MemberKey], typing.Optional[MemberKey]]) -> typing.Optional[MemberKey]:
+        """Gives you the ancestor of a user the given amount of generations up, or None if they don't have one
+
+        Params:
+            key: MemberKey
+                The (discord_id, guild_id) key of the user
+            generations: int
+                How many generations to go up
+            parent_of: callable
+                A function returning the key of a given key's parent, or None
+        """
+
+        self._ensure(key, parent_of)
+        if generations > self._depths[key]:
+            return None
+        power = 0
+        while generations and key is not None:
+            if generations & 1:
+                jumps = self._jumps[key]
+                key = jumps[power] if power < len(jumps) else None
+            generations >>= 1
+            power += 1
+        return key
+
+    def lowest_common_ancestor(self, a:MemberKey, b:MemberKey, parent_of:typing.Callable[[MemberKey], typing.Optional[MemberKey]]) -> typing.Optional[MemberKey]:
+        """Gives you the closest shared ancestor of two users (which may be one of the users themselves),
+        or None if they don't share a bloodline
+
+        Params:
+            a: MemberKey
+            b: MemberKey
+                The (discord_id, guild_id) keys of the two users
+            parent_of: callable
+                A function returning the key of a given key's parent, or None
+        """
+
+        # Bring them both up to the same generation
+        a_depth, b_depth = self.depth(a, parent_of), self.depth(b, parent_of)
+        if a_depth > b_depth:
+            a = self.ancestor(a, a_depth - b_depth, parent_of)
+        elif b_depth > a_depth:
+            b = self.ancestor(b, b_depth - a_depth, parent_of)
+        if a == b:
+            return a
+
+        # Jump up as far as we can without them meeting
+        for power in reversed(range(len(self._jumps[a]))):
+            a_jumps, b_jumps = self._jumps[a], self._jumps[b]
+            if power < len(a_jumps) and power < len(b_jumps) and a_jumps[power] != b_jumps[power]:
+                a, b = a_jumps[power], b_jumps[power]
+
+        # Their parents are the common ancestor
+        a_parent = self._jumps[a][0] if self._jumps[a] else None
+        b_parent = self._jumps[b][0] if self._jumps[b] else None
+        if a_parent is None or a_parent != b_parent:
+            return None
+        return a_parent
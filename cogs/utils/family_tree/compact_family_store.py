@@ -0,0 +1,337 @@
+import array
+import bisect
+import string
+import typing
+
+from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
+
+
+MemberKey = typing.Tuple[int, int]  # (discord_id, guild_id)
+NO_ROW = -1  # Used in the parent/partner columns for users who don't have one
+FREE_ID = -1  # Used in the ID column for rows that have been freed up to be reused
+
+
+def get_tree_id(row:int) -> str:
+    """Gives you a short, unique string for the given row, to be used as a tree ID"""
+
+    letters = []
+    while True:
+        row, remainder = divmod(row, len(string.ascii_letters))
+        letters.append(string.ascii_letters[remainder])
+        if row == 0:
+            return ''.join(letters)
+
+
+class CompactFamilyStore(object):
+    """A drop-in replacement for FamilyTreeMember.all_users that stores the whole family tree
+    in flat integer arrays, rather than as one Python object per user
+
+    Every user is given a dense row number, and their parent and partner are stored as row numbers
+    in array columns. Children are stored in a CSR-style layout (one array of offsets and one array
+    of child rows), with any changes made since the last compaction kept in a small overflow dict.
+    Rows are found through a sorted array of user IDs per guild, rather than a dict, so each user
+    only costs 12 bytes to look up. Rows that are popped are put on a free list to be reused.
+
+    Lookups give you a CompactFamilyTreeMember, which is just a view over the arrays, so the cogs
+    can carry on using the same get/partner/parent/children interface as they always have. Like a
+    dict, get gives you the default for users that aren't stored - use view if you want an empty
+    user that'll be stored once it's given a relation.
+    """
+
+    COMPACT_THRESHOLD = 0.01  # How much of the store needs to have changed before compact bothers rebuilding the arrays
+
+    def __init__(self):
+        self._index: typing.Dict[int, typing.Tuple[array.array, array.array]] = {}  # GuildID: (sorted user IDs, their rows)
+        self._free_rows = array.array('i')
+        self._ids = array.array('q')
+        self._guild_ids = array.array('q')
+        self._parents = array.array('i')
+        self._partners = array.array('i')
+        self._child_offsets = array.array('i', [0])
+        self._child_rows = array.array('i')
+        self._changed_children: typing.Dict[int, array.array] = {}  # Row: child rows, for changes since the last compaction
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._free_rows)
+
+    def __contains__(self, key:MemberKey) -> bool:
+        return self.row(key) is not None
+
+    def __iter__(self) -> typing.Iterator[MemberKey]:
+        return iter(self.keys())
+
+    def __getitem__(self, key:MemberKey) -> 'CompactFamilyTreeMember':
+        if key not in self:
+            raise KeyError(key)
+        return CompactFamilyTreeMember(*key)
+
+    def __setitem__(self, key:MemberKey, user:FamilyTreeMember) -> None:
+        """Copies the relations from a FamilyTreeMember (or a view over another user) into the arrays"""
+
+        parent_id, partner_id, children = user._parent, user._partner, user._children  # Read before writing, in case it's a view over this same user
+        row = self.row(key, create=True)
+        self._parents[row] = self.row((parent_id, key[1]), create=True) if parent_id else NO_ROW
+        self._partners[row] = self.row((partner_id, key[1]), create=True) if partner_id else NO_ROW
+        self._changed_children[row] = array.array('i', [self.row((i, key[1]), create=True) for i in children])
+
+    def get(self, key:MemberKey, default=None) -> typing.Optional['CompactFamilyTreeMember']:
+        """Gives you a view over the given user, or the default if they aren't stored"""
+
+        if self.row(key) is None:
+            return default
+        return CompactFamilyTreeMember(*key)
+
+    @staticmethod
+    def view(key:MemberKey) -> 'CompactFamilyTreeMember':
+        """Gives you a view over the given user, whether they're stored or not - the view acts
+        as an empty user until they're given a relation"""
+
+        return CompactFamilyTreeMember(*key)
+
+    def pop(self, key:MemberKey, default=None) -> 'CompactFamilyTreeMember':
+        """Removes the given user from the store, freeing up their row to be reused
+        Since the row can be given to someone else, anyone still pointing at the user (eg their
+        partner) has that relation removed too - in practice their whole family is popped together"""
+
+        discord_id, guild_id = key
+        row = self.row(key)
+        if row is None:
+            return default
+
+        # Remove anything pointing at the row
+        partner_row = self._partners[row]
+        if partner_row != NO_ROW and self._partners[partner_row] == row:
+            self._partners[partner_row] = NO_ROW
+        parent_row = self._parents[row]
+        if parent_row != NO_ROW:
+            self._changed_children[parent_row] = array.array('i', [i for i in self._get_child_rows(parent_row) if i != row])
+        for child_row in self._get_child_rows(row):
+            if self._parents[child_row] == row:
+                self._parents[child_row] = NO_ROW
+
+        # Free the row
+        ids, rows = self._index[guild_id]
+        position = bisect.bisect_left(ids, discord_id)
+        del ids[position]
+        del rows[position]
+        self._ids[row] = FREE_ID
+        self._parents[row] = NO_ROW
+        self._partners[row] = NO_ROW
+        self._changed_children[row] = array.array('i')
+        self._free_rows.append(row)
+        return CompactFamilyTreeMember(*key)
+
+    def keys(self) -> typing.Iterator[MemberKey]:
+        for row in range(len(self._ids)):
+            if self._ids[row] != FREE_ID:
+                yield (self._ids[row], self._guild_ids[row])
+
+    def values(self) -> typing.Iterator['CompactFamilyTreeMember']:
+        for key in self.keys():
+            yield CompactFamilyTreeMember(*key)
+
+    def items(self) -> typing.Iterator[typing.Tuple[MemberKey, 'CompactFamilyTreeMember']]:
+        for key in self.keys():
+            yield key, CompactFamilyTreeMember(*key)
+
+    def clear(self) -> None:
+        """Removes everything from the store"""
+
+        self.__init__()
+
+    def row(self, key:MemberKey, *, create:bool=False) -> typing.Optional[int]:
+        """Gives you the row number for a given user
+
+        Params:
+            key: MemberKey
+                The (discord_id, guild_id) key of the user
+            create: bool = False
+                Whether or not to add an empty row for the user if they don't have one already
+        """
+
+        discord_id, guild_id = key
+        index = self._index.get(guild_id)
+        position = 0
+        if index is not None:
+            ids, rows = index
+            position = bisect.bisect_left(ids, discord_id)
+            if position < len(ids) and ids[position] == discord_id:
+                return rows[position]
+        if not create:
+            return None
+
+        # Add a new empty row, reusing a free one if there is one
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self._ids[row] = discord_id
+            self._guild_ids[row] = guild_id
+        else:
+            row = len(self._ids)
+            self._ids.append(discord_id)
+            self._guild_ids.append(guild_id)
+            self._parents.append(NO_ROW)
+            self._partners.append(NO_ROW)
+        ids, rows = self._index.setdefault(guild_id, (array.array('q'), array.array('i')))
+        ids.insert(position, discord_id)
+        rows.insert(position, row)
+        return row
+
+    def load(self, partnerships:typing.Iterable[typing.Tuple[int, int, int]], parents:typing.Iterable[typing.Tuple[int, int, int]]) -> None:
+        """Bulk loads the family tree into the store, replacing whatever's already there
+
+        Params:
+            partnerships: list
+                An iterable of (user_id, partner_id, guild_id)
+            parents: list
+                An iterable of (parent_id, child_id, guild_id)
+        """
+
+        # Give everyone a row, through a dict for now so that the sorted index only has to be built once
+        self.clear()
+        new_rows: typing.Dict[MemberKey, int] = {}
+
+        def get_row(key:MemberKey) -> int:
+            row = new_rows.get(key)
+            if row is None:
+                row = new_rows[key] = len(self._ids)
+                self._ids.append(key[0])
+                self._guild_ids.append(key[1])
+                self._parents.append(NO_ROW)
+                self._partners.append(NO_ROW)
+            return row
+
+        for user_id, partner_id, guild_id in partnerships:
+            self._partners[get_row((user_id, guild_id))] = get_row((partner_id, guild_id))
+        for parent_id, child_id, guild_id in parents:
+            self._parents[get_row((child_id, guild_id))] = get_row((parent_id, guild_id))
+        for (discord_id, guild_id), row in sorted(new_rows.items()):  # Ordered by user ID, so each guild's IDs are added in order
+            ids, rows = self._index.setdefault(guild_id, (array.array('q'), array.array('i')))
+            ids.append(discord_id)
+            rows.append(row)
+        del new_rows
+
+        # Build the children from the parent column, ordered by row
+        counts = array.array('i', [0]) * (len(self._ids) + 1)
+        for parent_row in self._parents:
+            if parent_row != NO_ROW:
+                counts[parent_row + 1] += 1
+        for row in range(len(self._ids)):
+            counts[row + 1] += counts[row]
+        self._child_offsets = counts
+        self._child_rows = array.array('i', [0]) * counts[-1]
+        insert_at = array.array('i', counts[:-1])
+        for child_row, parent_row in enumerate(self._parents):
+            if parent_row != NO_ROW:
+                self._child_rows[insert_at[parent_row]] = child_row
+                insert_at[parent_row] += 1
+
+    def compact(self, force:bool=False) -> int:
+        """Folds any children changes since the last compaction back into the CSR arrays,
+        giving back how many users' changes were folded in
+        Since this rebuilds the whole of the children arrays, it only does anything once at least
+        COMPACT_THRESHOLD of the store has changed, unless it's forced"""
+
+        changed = len(self._changed_children)
+        if not changed or (not force and changed < len(self._ids) * self.COMPACT_THRESHOLD):
+            return 0
+        offsets = array.array('i', [0])
+        child_rows = array.array('i')
+        for row in range(len(self._ids)):
+            child_rows.extend(self._get_child_rows(row))
+            offsets.append(len(child_rows))
+        self._child_offsets = offsets
+        self._child_rows = child_rows
+        self._changed_children.clear()
+        return changed
+
+    def _get_child_rows(self, row:int) -> array.array:
+        """Gives you the child rows for a given row"""
+
+        changed = self._changed_children.get(row)
+        if changed is not None:
+            return changed
+        if row + 1 >= len(self._child_offsets):
+            return array.array('i')
+        return self._child_rows[self._child_offsets[row]:self._child_offsets[row + 1]]
+
+    def get_parent(self, key:MemberKey) -> typing.Optional[int]:
+        row = self.row(key)
+        if row is None or self._parents[row] == NO_ROW:
+            return None
+        return self._ids[self._parents[row]]
+
+    def set_parent(self, key:MemberKey, parent_id:typing.Optional[int]) -> None:
+        if parent_id is None and key not in self:
+            return
+        row = self.row(key, create=True)
+        self._parents[row] = self.row((parent_id, key[1]), create=True) if parent_id else NO_ROW
+
+    def get_partner(self, key:MemberKey) -> typing.Optional[int]:
+        row = self.row(key)
+        if row is None or self._partners[row] == NO_ROW:
+            return None
+        return self._ids[self._partners[row]]
+
+    def set_partner(self, key:MemberKey, partner_id:typing.Optional[int]) -> None:
+        if partner_id is None and key not in self:
+            return
+        row = self.row(key, create=True)
+        self._partners[row] = self.row((partner_id, key[1]), create=True) if partner_id else NO_ROW
+
+    def get_children(self, key:MemberKey) -> typing.List[int]:
+        row = self.row(key)
+        if row is None:
+            return []
+        return [self._ids[i] for i in self._get_child_rows(row)]
+
+    def set_children(self, key:MemberKey, children:typing.List[int]) -> None:
+        if not children and key not in self:
+            return
+        row = self.row(key, create=True)
+        self._changed_children[row] = array.array('i', [self.row((i, key[1]), create=True) for i in children])
+
+    def get_tree_id(self, key:MemberKey) -> str:
+        return get_tree_id(self.row(key, create=True))
+
+
+class CompactFamilyTreeMember(FamilyTreeMember):
+    """A FamilyTreeMember that's just a view over a CompactFamilyStore - it holds
+    nothing but the user's key, and reads everything else from the store"""
+
+    __slots__ = ()
+
+    def __init__(self, discord_id:int, guild_id:int=0):
+        self.id: int = discord_id
+        self._guild_id: int = guild_id
+
+    @property
+    def _key(self) -> MemberKey:
+        return (self.id, self._guild_id)
+
+    @property
+    def _parent(self) -> typing.Optional[int]:
+        return self.all_users.get_parent(self._key)
+
+    @_parent.setter
+    def _parent(self, value:typing.Optional[int]):
+        self.all_users.set_parent(self._key, value)
+
+    @property
+    def _partner(self) -> typing.Optional[int]:
+        return self.all_users.get_partner(self._key)
+
+    @_partner.setter
+    def _partner(self, value:typing.Optional[int]):
+        self.all_users.set_partner(self._key, value)
+
+    @property
+    def _children(self) -> typing.List[int]:
+        return self.all_users.get_children(self._key)
+
+    @_children.setter
+    def _children(self, value:typing.List[int]):
+        self.all_users.set_children(self._key, value)
+
+    @property
+    def tree_id(self) -> str:
+        return self.all_users.get_tree_id(self._key)
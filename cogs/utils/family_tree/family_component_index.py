@@ -0,0 +1,264 @@
+import collections
+import itertools
+import typing
+
+
+MemberKey = typing.Tuple[int, int]  # (discord_id, guild_id)
+
+
+class FamilyComponentIndex(object):
+    """Keeps track of which connected family each user is a part of, as well as
+    how big that family is, so that we don't need to walk the whole tree every
+    time we want to know the size of it
+
+    Users that aren't connected to anybody aren't stored at all - they're a family of one
+
+    Each component also has a version number, which changes every time anything in that family
+    changes, so that things generated from the family can be cached against it
+
+    Components that might contain a loop (eg someone marrying their cousin) are flagged, since
+    a lot of things are much simpler in a family that's just a tree
+    """
+
+    __slots__ = ('_component_of', '_members', '_versions', '_cyclic', '_id_counter', '_version_counter')
+
+    def __init__(self):
+        self._component_of: typing.Dict[MemberKey, int] = {}  # Key: component ID
+        self._members: typing.Dict[int, typing.Set[MemberKey]] = {}  # Component ID: keys
+        self._versions: typing.Dict[int, int] = {}  # Component ID: version
+        self._cyclic: typing.Set[int] = set()  # Component IDs that might have a loop in them
+        self._id_counter = itertools.count(1)
+        self._version_counter = itertools.count(1)
+
+    def clear(self) -> None:
+        """Removes everything from the index"""
+
+        self._component_of.clear()
+        self._members.clear()
+        self._versions.clear()
+        self._cyclic.clear()
+
+    def rebuild(self, keys:typing.Iterable[MemberKey], neighbours:typing.Callable[[MemberKey], typing.Iterable[MemberKey]]) -> None:
+        """Throws away the current index and works out every component from scratch
+        Much faster than adding the edges one at a time when loading a whole tree
+
+        Params:
+            keys: list
+                The keys of every user in the tree
+            neighbours: callable
+                A function returning the keys of everyone directly connected to a given key
+        """
+
+        self.clear()
+        for key in keys:
+            if key in self._component_of:
+                continue
+            component = {key}
+            queue = collections.deque([key])
+            connections = 0
+            while queue:
+                for other in neighbours(queue.popleft()):
+                    connections += 1
+                    if other not in component:
+                        component.add(other)
+                        queue.append(other)
+            component_id = self._new_component(component)
+            if component_id is not None and connections // 2 >= len(component):
+                self._cyclic.add(component_id)
+
+    def component_id(self, key:MemberKey) -> typing.Optional[int]:
+        """Gives you the ID of the component that a user is in, or None if they're
+        not connected to anybody"""
+
+        return self._component_of.get(key)
+
+    def version(self, key:MemberKey) -> int:
+        """Gives you the version of the given user's family
+        Versions are unique across every family, and change whenever the family does"""
+
+        component_id = self._component_of.get(key)
+        if component_id is None:
+            return 0
+        return self._versions[component_id]
+
+    def touch(self, key:MemberKey) -> None:
+        """Bumps the version of the given user's family"""
+
+        component_id = self._component_of.get(key)
+        if component_id is not None:
+            self._versions[component_id] = next(self._version_counter)
+
+    def is_tree(self, key:MemberKey) -> bool:
+        """Whether or not the given user's family is definitely free of loops"""
+
+        return self._component_of.get(key) not in self._cyclic
+
+    def size(self, key:MemberKey) -> int:
+        """Gives you the amount of people in the given user's family, including themselves"""
+
+        component_id = self._component_of.get(key)
+        if component_id is None:
+            return 1
+        return len(self._members[component_id])
+
+    def members(self, key:MemberKey) -> typing.Set[MemberKey]:
+        """Gives you the keys of every user in the given user's family"""
+
+        component_id = self._component_of.get(key)
+        if component_id is None:
+            return {key}
+        return self._members[component_id]
+
+    def same_component(self, a:MemberKey, b:MemberKey) -> bool:
+        """Whether or not the two given users are in the same family"""
+
+        if a == b:
+            return True
+        component_id = self._component_of.get(a)
+        return component_id is not None and component_id == self._component_of.get(b)
+
+    def add_edge(self, a:MemberKey, b:MemberKey) -> None:
+        """Connects two users together, merging their components should they be different
+        Does nothing if they're already in the same component, so it's safe to call for both sides
+        of a relationship - use mark_cyclic for a new relationship between users who were already related
+
+        Params:
+            a: MemberKey
+            b: MemberKey
+                The (discord_id, guild_id) keys of the two users being connected
+        """
+
+        # Get their current components
+        a_id = self._component_of.get(a)
+        b_id = self._component_of.get(b)
+        if a_id is not None and a_id == b_id:
+            return
+
+        # Neither of them are in a family so make a new one
+        if a_id is None and b_id is None:
+            self._new_component({a, b})
+            return
+
+        # Add the smaller one into the larger one
+        a_size = len(self._members[a_id]) if a_id is not None else 1
+        b_size = len(self._members[b_id]) if b_id is not None else 1
+        if a_size < b_size:
+            a, b, a_id, b_id = b, a, b_id, a_id
+        moving = self._members.pop(b_id) if b_id is not None else {b}
+        self._versions.pop(b_id, None)
+        if b_id in self._cyclic:
+            self._cyclic.discard(b_id)
+            self._cyclic.add(a_id)
+        target = self._members[a_id]
+        for key in moving:
+            self._component_of[key] = a_id
+        target.update(moving)
+        self.touch(a)
+
+    def mark_cyclic(self, key:MemberKey) -> None:
+        """Marks the given user's family as no longer being a tree, for when two of its members
+        who were already related are given a new relationship"""
+
+        component_id = self._component_of.get(key)
+        if component_id is not None:
+            self._cyclic.add(component_id)
+            self.touch(key)
+
+    def remove_edge(self, a:MemberKey, b:MemberKey, neighbours:typing.Callable[[MemberKey], typing.Iterable[MemberKey]]) -> None:
+        """Disconnects two users from each other, splitting their component should
+        there no longer be a path between them
+        This should be called _after_ the relationship has been removed from the tree
+
+        Params:
+            a: MemberKey
+            b: MemberKey
+                The (discord_id, guild_id) keys of the two users being disconnected
+            neighbours: callable
+                A function returning the keys of everyone directly connected to a given key
+        """
+
+        # Make sure they were even connected in the first place
+        component_id = self._component_of.get(a)
+        if component_id is None or component_id != self._component_of.get(b):
+            return
+
+        # Search outwards from both sides at the same time - whichever runs out of people first
+        # is the smaller half of the split, so we only ever relabel the smaller half
+        visited = ({a}, {b})
+        queues = (collections.deque([a]), collections.deque([b]))
+        while queues[0] and queues[1]:
+            for side in (0, 1):
+                current = queues[side].popleft()
+                for key in neighbours(current):
+                    if key in visited[1 - side]:
+                        self.touch(a)
+                        return  # They're still connected
+                    if key not in visited[side]:
+                        visited[side].add(key)
+                        queues[side].append(key)
+                if not queues[side]:
+                    break
+
+        # Whichever side finished is now its own component - we can't tell which side any loops were on
+        split = visited[0] if not queues[0] else visited[1]
+        remaining = self._members[component_id]
+        remaining.difference_update(split)
+        split_id = self._new_component(split)
+        if split_id is not None and component_id in self._cyclic:
+            self._cyclic.add(split_id)
+        if len(remaining) <= 1:
+            for key in remaining:
+                del self._component_of[key]
+            del self._members[component_id]
+            del self._versions[component_id]
+            self._cyclic.discard(component_id)
+        else:
+            self._versions[component_id] = next(self._version_counter)
+
+    def discard(self, key:MemberKey) -> None:
+        """Removes the given user's whole family from the index"""
+
+        component_id = self._component_of.get(key)
+        if component_id is None:
+            return
+        for i in self._members.pop(component_id):
+            del self._component_of[i]
+        del self._versions[component_id]
+        self._cyclic.discard(component_id)
+
+    def update_member(self, key:MemberKey, old_neighbours:typing.Iterable[MemberKey], new_neighbours:typing.Iterable[MemberKey], neighbours:typing.Callable[[MemberKey], typing.Iterable[MemberKey]]) -> None:
+        """Updates the index for a user whose relations have been wholesale replaced (eg from redis)
+
+        Params:
+            key: MemberKey
+                The (discord_id, guild_id) key of the user who was updated
+            old_neighbours: list
+                The keys of who they were connected to before
+            new_neighbours: list
+                The keys of who they're connected to now
+            neighbours: callable
+                A function returning the keys of everyone directly connected to a given key
+        """
+
+        old_neighbours, new_neighbours = set(old_neighbours), set(new_neighbours)
+        for other in new_neighbours - old_neighbours:
+            if key not in neighbours(other) and self.same_component(key, other):
+                self.mark_cyclic(key)  # A new relationship between users who were already related
+            self.add_edge(key, other)
+        for other in old_neighbours - new_neighbours:
+            self.remove_edge(key, other, neighbours)
+        self.touch(key)
+
+    def _new_component(self, keys:typing.Set[MemberKey]) -> typing.Optional[int]:
+        """Stores a set of keys as a brand new component, giving back its ID"""
+
+        if len(keys) <= 1:
+            for key in keys:
+                self._component_of.pop(key, None)
+            return None
+        component_id = next(self._id_counter)
+        self._members[component_id] = keys
+        self._versions[component_id] = next(self._version_counter)
+        for key in keys:
+            self._component_of[key] = component_id
+        return component_id
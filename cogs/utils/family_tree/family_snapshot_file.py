@@ -0,0 +1,115 @@
+import array
+import os
+import struct
+import sys
+import typing
+from datetime import datetime as dt, timedelta
+
+
+FamilyRow = typing.Tuple[int, int, int]  # (user_id, partner_id, guild_id) or (parent_id, child_id, guild_id)
+EPOCH = dt(1970, 1, 1)
+
+
+class FamilySnapshotFile(object):
+    """A binary copy of the marriages and parents tables saved to disk, so that the bot can start up
+    from the file and only ask the database for the rows added since it was written
+
+    The file is a fixed header followed by two flat arrays of little-endian 64-bit ints - one of
+    (user_id, partner_id, guild_id) for marriages and one of (parent_id, child_id, guild_id) for
+    parents - so the whole thing can be loaded with a single read
+
+    Only rows older than the high-water mark are stored in the file. Since rows are never updated
+    in place, the snapshot is still valid as long as the database has the same amount of rows
+    up to that high-water mark once any rows deleted since then (from the family_deletions table)
+    are taken back out of it - if the counts don't match, it needs to be thrown away
+
+    Params:
+        path: str
+            Where the snapshot is saved
+    """
+
+    MAGIC = b'MBFS'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHBqqq')  # Magic, version, server specific, high-water mark (microseconds since epoch), marriage count, parent count
+    SAFETY_MARGIN = timedelta(minutes=5)  # How far behind the newest row the high-water mark is kept, for transactions that commit late
+    DELETION_LOG_TIME = timedelta(days=7)  # How long deletions are kept in the family_deletions table - older snapshots aren't used
+
+    def __init__(self, path:str):
+        self.path = path
+
+    def read(self, server_specific:bool) -> typing.Optional[typing.Tuple[dt, typing.List[FamilyRow], typing.List[FamilyRow]]]:
+        """Loads the snapshot from disk, giving back (high_water_mark, marriages, parents), or None
+        if there's no usable snapshot
+
+        Params:
+            server_specific: bool
+                Whether the bot is running in server specific mode - snapshots from the other mode are ignored
+        """
+
+        try:
+            with open(self.path, 'rb') as a:
+                data = a.read()
+        except OSError:
+            return None
+        if len(data) < self.HEADER.size:
+            return None
+        magic, version, snapshot_server_specific, high_water_mark, marriage_count, parent_count = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION or bool(snapshot_server_specific) != server_specific:
+            return None
+        if len(data) != self.HEADER.size + (marriage_count + parent_count) * 3 * 8:
+            return None
+
+        # Read the arrays
+        values = array.array('q')
+        values.frombytes(data[self.HEADER.size:])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        split = marriage_count * 3
+        marriages = list(zip(values[0:split:3], values[1:split:3], values[2:split:3]))
+        parents = list(zip(values[split::3], values[split + 1::3], values[split + 2::3]))
+        return EPOCH + timedelta(microseconds=high_water_mark), marriages, parents
+
+    def write(self, server_specific:bool, high_water_mark:dt, marriages:typing.List[FamilyRow], parents:typing.List[FamilyRow]) -> None:
+        """Saves a snapshot to disk, replacing the one that's already there
+
+        Params:
+            server_specific: bool
+                Whether the bot is running in server specific mode
+            high_water_mark: datetime
+                Every row given must be from at or before this time
+            marriages: list
+                A list of (user_id, partner_id, guild_id)
+            parents: list
+                A list of (parent_id, child_id, guild_id)
+        """
+
+        values = array.array('q', [i for row in marriages for i in row])
+        values.extend([i for row in parents for i in row])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, server_specific,
+            (high_water_mark - EPOCH) // timedelta(microseconds=1), len(marriages), len(parents),
+        )
+
+        # Write to a temp file first so nobody reads a half-written snapshot
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'wb') as a:
+            a.write(header)
+            values.tofile(a)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def remove_deleted(rows:typing.List[FamilyRow], deleted:typing.Iterable[FamilyRow]) -> typing.List[FamilyRow]:
+        """Gives you the given snapshot rows without any of the deleted ones"""
+
+        deleted = set(deleted)
+        if not deleted:
+            return rows
+        return [i for i in rows if i not in deleted]
+
+    @classmethod
+    def get_high_water_mark(cls) -> dt:
+        """Gives you the high-water mark to use for a snapshot written right now"""
+
+        return dt.utcnow() - cls.SAFETY_MARGIN
@@ -1,12 +1,19 @@
 import re as regex
 import random
+import asyncio
 import string
+import sys
 import typing
+import weakref
 
 from discord import User, Guild
 
 from cogs.utils.customised_tree_user import CustomisedTreeUser
 from cogs.utils.family_tree.relation_simplifier import Simplifier
+from cogs.utils.family_tree.family_component_index import FamilyComponentIndex
+from cogs.utils.family_tree.tree_cache import TreeCache
+from cogs.utils.family_tree.ancestor_index import AncestorIndex
+from cogs.utils.family_tree.guild_member_index import GuildMemberIndex
 
 
 def get_random_string(length:int=10) -> str:
@@ -17,28 +24,123 @@ class FamilyTreeMember(object):
     """A class representing a member of a family"""
 
     all_users: typing.Dict[typing.Tuple[int, int], 'FamilyTreeMember'] = {}
+    family_components: FamilyComponentIndex = FamilyComponentIndex()  # Which family each user in all_users is part of
+    tree_cache: TreeCache = TreeCache()  # Generational spans and DOT scripts, keyed by family version
+    ancestors: AncestorIndex = AncestorIndex()  # Depths and ancestor jump tables for each bloodline
+    guild_members: GuildMemberIndex = GuildMemberIndex()  # Member ID sets for guild-filtered trees
+    worker_pool: 'FamilyWorkerPool' = None  # Set by the bot if big families should be worked on in another process
+    lazy_loader: 'LazyFamilyLoader' = None  # Set by the bot if families should only be loaded from the database when they're needed
+    transient_users: typing.Dict[typing.Tuple[int, int], 'FamilyTreeMember'] = weakref.WeakValueDictionary()  # Users with no relations, who aren't in all_users
+    reclaimed_members: int = 0  # How many empty users have been swept out of all_users
+    reclaimed_bytes: int = 0  # Roughly how much memory that freed up
     INVISIBLE = '[shape=circle, label="", height=0.001, width=0.001]'  # For the DOT script
-    __slots__ = ('id', '_children', '_parent', '_partner', 'tree_id', '_guild_id')
+    __slots__ = ('id', '_children', '_parent', '_partner', '_tree_id', '_guild_id', '__weakref__')
 
     def __init__(self, discord_id:int, children:list=None, parent_id:int=None, partner_id:int=None, guild_id:int=0):
         self.id: int = discord_id
         self._children: typing.List[int] = children or list()
         self._parent: int = parent_id
         self._partner: int = partner_id
-        self.tree_id: str = get_random_string()  # Used purely for the dot joining two spouses in the GZ script
+        self._tree_id: str = None  # Populated by 'tree_id' property
         self._guild_id: int = guild_id
-        self.all_users[(self.id, self._guild_id)] = self
+
+        # Cache and update the family index, since this might be replacing an old object
+        key = (self.id, self._guild_id)
+        old = self.all_users.get(key)
+        old_neighbours = old._neighbour_keys() if old else []
+        old_parent = old._parent if old else None
+        self.all_users[key] = self
+        self.transient_users.pop(key, None)
+        self.family_components.update_member(key, old_neighbours, self._neighbour_keys(), self.get_neighbour_keys)
+        if old_parent != self._parent:
+            self.ancestors.invalidate(key)
 
     @classmethod
     def get(cls, discord_id:int, guild_id:int=0):
-        """Gives you the object pertaining to the given user ID"""
+        """Gives you the object pertaining to the given user ID
+        Users who aren't in the tree are given back as a transient object that's only stored
+        in all_users once they're given a relation"""
 
         if discord_id is None:
             return None
-        v = cls.all_users.get((discord_id, guild_id))
+        key = (discord_id, guild_id)
+        v = cls.all_users.get(key)
         if v:
             return v
-        return cls(discord_id=discord_id, guild_id=guild_id)
+        if not isinstance(cls.all_users, dict):
+            return cls.all_users.view(key)  # The compact store's views store themselves when they're given a relation
+        v = cls.transient_users.get(key)
+        if v is None:
+            v = cls.__new__(cls)
+            v.id, v._children, v._parent, v._partner, v._tree_id, v._guild_id = discord_id, list(), None, None, None, guild_id
+            cls.transient_users[key] = v
+        return v
+
+    def _store(self) -> None:
+        """Puts this user into all_users if they're only a transient object
+        If someone else has been stored for the same user since this object was made, their relations are
+        copied over so nothing's lost, as long as this object hasn't been given any relations of its own"""
+
+        key = (self.id, self._guild_id)
+        if not isinstance(self.all_users, dict):
+            if key not in self.all_users:
+                self.all_users[key] = self  # Views of the same user all share the same row
+            return
+        stored = self.all_users.get(key)
+        if stored is self:
+            return
+        if stored is not None:
+            if not self.is_empty:
+                raise ValueError(f"User {key} has been replaced in the tree since this object was made")
+            self._children, self._parent, self._partner = list(stored._children), stored._parent, stored._partner
+        self.all_users[key] = self
+        self.transient_users.pop(key, None)
+
+    @classmethod
+    def sweep_empty(cls) -> int:
+        """Removes every user with no relations from all_users, giving back how many were removed
+        Anyone still holding onto a removed user can carry on using it, since it'll be stored again
+        as soon as it's given a relation"""
+
+        if not isinstance(cls.all_users, dict):
+            return 0  # The compact store doesn't have anything to free
+        empty_keys = [key for key, user in cls.all_users.items() if user.is_empty and cls.family_components.component_id(key) is None]
+        for key in empty_keys:
+            user = cls.all_users.pop(key)
+            cls.ancestors.invalidate(key)
+            cls.transient_users[key] = user
+            cls.reclaimed_bytes += sys.getsizeof(user) + sys.getsizeof(user._children) + sys.getsizeof(key)
+        cls.reclaimed_members += len(empty_keys)
+        return len(empty_keys)
+
+    @classmethod
+    def add_relations(cls, partnerships:typing.Iterable[typing.Tuple[int, int, int]], parents:typing.Iterable[typing.Tuple[int, int, int]]) -> None:
+        """Adds a set of marriages and parents to the tree, skipping over any users who already have a partner or parent
+
+        Params:
+            partnerships: list
+                An iterable of (user_id, partner_id, guild_id)
+            parents: list
+                An iterable of (parent_id, child_id, guild_id)
+        """
+
+        for user_id, partner_id, guild_id in partnerships:
+            user = cls.get(user_id, guild_id)
+            if user._partner is None:
+                user.add_partner(cls.get(partner_id, guild_id))
+        for parent_id, child_id, guild_id in parents:
+            child = cls.get(child_id, guild_id)
+            if child._parent is None:
+                cls.get(parent_id, guild_id).add_child(child)
+
+    @classmethod
+    def remove_guild(cls, guild_id:int) -> None:
+        """Removes every user in the given guild from the tree"""
+
+        for key in [i for i in cls.all_users.keys() if i[1] == guild_id]:
+            cls.family_components.discard(key)
+            cls.ancestors.invalidate(key)
+            cls.all_users.pop(key, None)
 
     def to_json(self) -> dict:
         """Converts the object to JSON format so you can throw it through redis"""
@@ -61,12 +163,85 @@ class FamilyTreeMember(object):
         return f"FamilyTreeMember[{self.id} <Partner {self._partner} <{len(self._children)} children>]"
 
     def __eq__(self, other) -> bool:
-        if not isinstance(other, self.__class__):
+        if not isinstance(other, FamilyTreeMember):
             return False
-        return all([
-            self.id == other.id,
-            self._guild_id == other._guild_id,
-        ])
+        return (self.id, self._guild_id) == (other.id, other._guild_id)
+
+    def __hash__(self) -> int:
+        return hash((self.id, self._guild_id))
+
+    @property
+    def tree_id(self) -> str:
+        """A random string used to identify this user in GEDCOM scripts"""
+
+        if self._tree_id is None:
+            self._tree_id = get_random_string()
+        return self._tree_id
+
+    def _neighbour_keys(self) -> typing.List[typing.Tuple[int, int]]:
+        """Gives you the keys of every user directly connected to this one"""
+
+        keys = [(i, self._guild_id) for i in self._children]
+        if self._parent:
+            keys.append((self._parent, self._guild_id))
+        if self._partner:
+            keys.append((self._partner, self._guild_id))
+        return keys
+
+    @classmethod
+    def get_neighbour_keys(cls, key:typing.Tuple[int, int]) -> typing.List[typing.Tuple[int, int]]:
+        """Gives you the keys of every user directly connected to the given key, without
+        creating a new object for them"""
+
+        user = cls.all_users.get(key)
+        if user is None:
+            return []
+        return user._neighbour_keys()
+
+    def add_partner(self, partner:'FamilyTreeMember') -> None:
+        """Marries this user to the given user, updating both of their caches"""
+
+        self._store()
+        partner._store()
+        self._partner = partner.id
+        partner._partner = self.id
+        self._connect((partner.id, partner._guild_id))
+
+    def _connect(self, other_key:typing.Tuple[int, int]) -> None:
+        """Adds a new relationship between this user and another to the family index"""
+
+        key = (self.id, self._guild_id)
+        if self.family_components.same_component(key, other_key):
+            self.family_components.mark_cyclic(key)  # They were already related
+        self.family_components.add_edge(key, other_key)
+
+    def remove_partner(self) -> None:
+        """Divorces this user from their partner, updating both of their caches"""
+
+        partner = self.partner
+        if partner is None:
+            return
+        self._partner = None
+        partner._partner = None
+        self.family_components.remove_edge((self.id, self._guild_id), (partner.id, partner._guild_id), self.get_neighbour_keys)
+
+    def add_child(self, child:'FamilyTreeMember') -> None:
+        """Adds the given user as a child of this one, updating both of their caches"""
+
+        self._store()
+        child._store()
+        self._children = self._children + [child.id]
+        child._parent = self.id
+        self._connect((child.id, child._guild_id))
+        self.ancestors.invalidate((child.id, child._guild_id))
+
+    def remove_child(self, child:'FamilyTreeMember') -> None:
+        """Removes the given user as a child of this one, updating both of their caches"""
+
+        self._children = [i for i in self._children if i != child.id]
+        child._parent = None
+        self.family_components.remove_edge((self.id, self._guild_id), (child.id, child._guild_id), self.get_neighbour_keys)
+        self.ancestors.invalidate((child.id, child._guild_id))
 
     @property
     def partner(self):
@@ -102,73 +277,81 @@ class FamilyTreeMember(object):
             self._partner == None,
         ])
 
+    def is_related(self, target_user) -> bool:
+        """Whether or not you're related to another given FamilyTreeMember object
+        Much cheaper than get_relation, since it never has to find the path between you"""
+
+        if target_user is None:
+            return False
+        key = (self.id, self._guild_id)
+        target_key = (target_user.id, target_user._guild_id)
+        return key != target_key and self.family_components.same_component(key, target_key)
+
     def get_relation(self, target_user):
         """Gets your relation to another given FamilyTreeMember object"""
 
-        text = self.get_unshortened_relation(target_user)
-        if text is None:
+        steps = self.get_relation_path(target_user)
+        if steps is None:
             return None
-        return Simplifier().simplify(text)
+        return Simplifier.simplify_steps(steps)
 
     @property
     def family_member_count(self) -> int:
         """Returns the number of people in the family"""
 
-        return len(self.span(add_parent=True, expand_upwards=True))
+        return self.family_components.size((self.id, self._guild_id))
 
-    def span(self, people_list:list=None, add_parent:bool=False, expand_upwards:bool=False, guild:Guild=None) -> list:
+    def span(self, add_parent:bool=False, expand_upwards:bool=False, guild:Guild=None, member_ids:typing.AbstractSet[int]=None) -> list:
         """
         Gets a list of every user related to this one
         If "add_parent" and "expand_upwards" are True, then it should add every user in a given tree,
         even if they're related through marriage's parents etc
 
         Params:
-            people_list: list
-                The list of users who are currently in the tree (so as to avoid recursion)
             add_parent: bool = False
                 Whether or not to add the parent of this user to the people list
             expand_upwards: bool = False
                 Whether or not to expand upwards in the tree
             guild: Guild = None
                 If added, span will return users only if they're in the given guild
+            member_ids: set = None
+                The IDs of the guild's members, if you've already got them
 
         Returns:
             A list of all people on the family for this user, in no particular order
         """
 
-        # Don't add yourself again
-        if people_list == None:
-            people_list = []
-        if self in people_list:
-            return people_list
+        if guild and member_ids is None:
+            member_ids = self.guild_members.get(guild)
+        people_list = []
+        added_already = set()
+        stack = [(self, add_parent)]  # (user, add_parent)
 
-        # Filter out non-guild members
-        if guild:
-            if not guild.get_member(self.id):
-                return people_list
+        while stack:
+            person, add_parent = stack.pop()
 
-        people_list.append(self)
+            # Don't add anyone again
+            if person in added_already:
+                continue
 
-        # Add your parent
-        if expand_upwards and add_parent and self._parent:
-            parent = self.parent
-            people_list = parent.span(people_list, add_parent=True, expand_upwards=expand_upwards, guild=guild)
+            # Filter out non-guild members
+            if member_ids is not None and person.id not in member_ids:
+                continue
 
-        # Add your children
-        if self._children:
-            children = self.children
-            for child in children:
-                people_list = child.span(people_list, add_parent=False, expand_upwards=expand_upwards, guild=guild)
+            added_already.add(person)
+            people_list.append(person)
 
-        # Add your partner
-        if self._partner:
-            partner = self.partner
-            people_list = partner.span(people_list, add_parent=True, expand_upwards=expand_upwards, guild=guild)
+            # Add their partner, children, and parent - in reverse, so the parent comes off the stack first
+            if person._partner:
+                stack.append((person.partner, True))
+            if person._children:
+                stack.extend((child, False) for child in reversed(person.children))
+            if expand_upwards and add_parent and person._parent:
+                stack.append((person.parent, True))
 
-        # Remove dupes, should they be in there
         return people_list
 
-    def get_root(self, guild:Guild=None):
+    def get_root(self, guild:Guild=None, member_ids:typing.AbstractSet[int]=None, max_generations:int=None):
         """
         Expands backwards into the tree up to a root user
         Only goes up one line of family so it cannot add your spouse's parents etc
@@ -176,14 +359,21 @@ class FamilyTreeMember(object):
         Params:
             guild: Guild = None
                 If you want to get users only from a given guild, supply a guild here
+            member_ids: set = None
+                The IDs of the guild's members, if you've already got them
+            max_generations: int = None
+                How many generations up the tree to go before stopping
         """
 
         # Set a default user to look at
         root_user = self
+        generations = 0
 
         # Avoid loops
         already_processed = []
-        member_in_guild = lambda user_id: guild.get_member(user_id) if guild is not None else True
+        if guild is not None and member_ids is None:
+            member_ids = self.guild_members.get(guild)
+        member_in_guild = lambda user_id: member_ids is None or user_id in member_ids
 
         while True:
             # Loop avoidance 2.0
@@ -191,85 +381,163 @@ class FamilyTreeMember(object):
                 return root_user
             already_processed.append(root_user)
 
+            # See if we've gone far enough
+            if max_generations is not None and generations >= max_generations:
+                return root_user
+
             # See if they have a parent
             if root_user._parent and member_in_guild(root_user._parent):
                 root_user = root_user.parent
+                generations += 1
 
             # They don't but their partner might
             elif root_user._partner and member_in_guild(root_user._partner):
                 partner = root_user.partner
                 if partner._parent and member_in_guild(partner._parent):
                     root_user = partner.parent
+                    generations += 1
 
             # Nope, we're outa here
             else:
                 return root_user
 
-    def get_unshortened_relation(self, target_user, working_relation:list=None, added_already:list=None) -> str:
+    @classmethod
+    def get_parent_key(cls, key:typing.Tuple[int, int]) -> typing.Optional[typing.Tuple[int, int]]:
+        """Gives you the key of the parent of the given key, without creating a new object for them"""
+
+        user = cls.all_users.get(key)
+        if user is None or not user._parent:
+            return None
+        return (user._parent, key[1])
+
+    @classmethod
+    def get_relation_steps(cls, key:typing.Tuple[int, int]) -> typing.List[typing.Tuple[str, typing.Tuple[int, int]]]:
+        """Gives you a list of (step, key) for every user directly connected to the given key,
+        where the step is how that user is related to the given one (ie 'parent', 'partner', 'child')"""
+
+        user = cls.all_users.get(key)
+        if user is None:
+            return []
+        guild_id = key[1]
+        steps = []
+        if user._parent:
+            steps.append(('parent', (user._parent, guild_id)))
+        if user._partner:
+            steps.append(('partner', (user._partner, guild_id)))
+        steps.extend(('child', (i, guild_id)) for i in user._children)
+        return steps
+
+    async def get_relation_in_worker(self, target_user):
+        """The same as get_relation, but done in the worker pool if the family is big enough"""
+
+        key = (self.id, self._guild_id)
+        if self.worker_pool is None or not self.worker_pool.should_offload(key) or not self.is_related(target_user):
+            return self.get_relation(target_user)
+        return await self.worker_pool.get_relation(self, target_user)
+
+    def get_unshortened_relation(self, target_user) -> str:
         """
         Gets your relation to the other given user or None
 
         Params:
             target_user : The user who you want to list the relation to
-            working_relation[list] : The list of relation steps it's taking to get
-            added_already[list] : So we can keep track of who's been looked at before
         """
 
-        # Set default values
-        if working_relation == None:
-            working_relation = []
-        if added_already == None:
-            added_already = []
+        steps = self.get_relation_path(target_user)
+        if steps is None:
+            return None
+        return "'s ".join(steps)
+
+    def get_relation_path(self, target_user) -> typing.Optional[typing.Tuple[str, ...]]:
+        """
+        Gets the steps ('parent', 'partner', 'child') from you to the other given user, or None
+        This is the shortest path between the two users, found by searching outwards from both at once
+
+        Params:
+            target_user : The user who you want to list the relation to
+        """
 
-        # You're doing a loop - return None
-        if self.id in added_already:
+        # See if there's even anything to search
+        start = (self.id, self._guild_id)
+        end = (target_user.id, target_user._guild_id)
+        if start == end:
+            return ()
+        if not self.family_components.same_component(start, end):
             return None
 
-        # We hit the jackpot - return the made up string
-        if target_user.id == self.id:
-            ret_string = "'s ".join(working_relation)
-            return ret_string
+        # In a family without any loops the only path between two blood relatives is through their closest
+        # common ancestor, so we can skip the search entirely
+        if self.family_components.is_tree(start):
+            ancestor = self.ancestors.lowest_common_ancestor(start, end, self.get_parent_key)
+            if ancestor is not None:
+                ancestor_depth = self.ancestors.depth(ancestor, self.get_parent_key)
+                up = self.ancestors.depth(start, self.get_parent_key) - ancestor_depth
+                down = self.ancestors.depth(end, self.get_parent_key) - ancestor_depth
+                return ('parent',) * up + ('child',) * down
+
+        # Each side maps a key to (the key it was found from, the step between them)
+        # Forward steps go from the found-from key to the key, backward steps go from the key to the found-from key
+        inverse_steps = {'parent': 'child', 'partner': 'partner', 'child': 'parent'}
+        forward = {start: None}
+        backward = {end: None}
+        forward_frontier = [start]
+        backward_frontier = [end]
+        meeting = None
+
+        # Expand whichever side has the smaller frontier, a whole generation at a time
+        while forward_frontier and backward_frontier and meeting is None:
+            searching_forward = len(forward_frontier) <= len(backward_frontier)
+            if searching_forward:
+                frontier, found, other = forward_frontier, forward, backward
+            else:
+                frontier, found, other = backward_frontier, backward, forward
+            next_frontier = []
+            for key in frontier:
+                for step, new_key in self.get_relation_steps(key):
+                    if new_key in found:
+                        continue
+                    found[new_key] = (key, step if searching_forward else inverse_steps[step])
+                    if new_key in other:
+                        meeting = new_key
+                        break
+                    next_frontier.append(new_key)
+                if meeting is not None:
+                    break
+            if searching_forward:
+                forward_frontier = next_frontier
+            else:
+                backward_frontier = next_frontier
 
-        # Add self to list of checked people
-        added_already.append(self.id)
+        # They're not connected after all
+        if meeting is None:
+            return None
 
-        # Check parent
-        if self._parent and self._parent not in added_already:
-            parent = self.parent
-            x = parent.get_unshortened_relation(
-                target_user,
-                working_relation=working_relation+['parent'],
-                added_already=added_already
-            )
-            if x: return x
-
-        # Check partner
-        if self._partner and self._partner not in added_already:
-            partner = self.partner
-            x = partner.get_unshortened_relation(
-                target_user,
-                working_relation=working_relation+['partner'],
-                added_already=added_already
-            )
-            if x: return x
-
-        # Check children
-        if self._children:
-            children = self.children
-            for i in [o for o in children if o not in added_already]:
-                x = i.get_unshortened_relation(
-                    target_user,
-                    working_relation=working_relation+['child'],
-                    added_already=added_already
-                )
-                if x: return x
-        return None
+        # Walk back from the meeting point to each of the users
+        working_relation = []
+        key = meeting
+        while forward[key] is not None:
+            key, step = forward[key]
+            working_relation.append(step)
+        working_relation.reverse()
+        key = meeting
+        while backward[key] is not None:
+            key, step = backward[key]
+            working_relation.append(step)
+        return tuple(working_relation)
 
     async def generate_gedcom_script(self, bot) -> str:
         """
         Gives you the INDI and FAM gedcom strings for this family tree
         Includes their spouse, if they have one, and any children
-        Small bit of redundancy: a family will be added twice if they have a spouse.
+        """
+
+        return '\n'.join([i async for i in self.generate_gedcom_lines(bot)])
+
+    async def generate_gedcom_lines(self, bot) -> typing.AsyncGenerator[str, None]:
+        """
+        Yields the lines of the gedcom file for this family tree, one at a time, so they can be
+        written straight into a file
+        Each couple (or single parent) gets one FAM record containing both of their children
         """
 
         """
@@ -283,118 +551,138 @@ class FamilyTreeMember(object):
             1 CHIL @I3@
         """
 
-        gedcom_text = []
-        family_id_cache = {}  # id: family count
         full_family = self.span(add_parent=True, expand_upwards=True)
+        couple_key = lambda user: (min(user.id, user._partner), max(user.id, user._partner)) if user._partner else (user.id, None)
 
+        # Work out every family - keyed by couple, and named after whoever in the couple came first
+        families = {}  # (partner_id, partner_id): (family_id, [spouses], [children])
         for i in full_family:
-            name = await bot.get_name(i.id)
-            working_text = [
-                f'0 @I{i.tree_id}@ INDI',
-                f'\t1 NAME {name}'
-            ]
-
-            # If you have a parent, get added to their family
+            if not i._children and not i._partner:
+                continue
+            family = families.get(couple_key(i))
+            if family is None:
+                family = families[couple_key(i)] = (i.tree_id, [i], [])
+                if i._partner:
+                    family[1].append(i.partner)
+            family[2].extend(i.children)
+
+        # Get everyone's names at once
+        user_ids = [i.id for i in full_family]
+        names = dict(zip(user_ids, await asyncio.gather(*[bot.get_name(i) for i in user_ids])))
+
+        # Add the people
+        yield '0 HEAD\n\t1 GEDC\n\t\t2 VERS 5.5\n\t\t2 FORM LINEAGE-LINKED\n\t1 CHAR UNICODE'
+        for i in full_family:
+            yield f'0 @I{i.tree_id}@ INDI'
+            yield f'\t1 NAME {names[i.id]}'
             if i._parent:
-                parent = i.parent
-                if parent.id in family_id_cache:
-                    working_text.append(f'\t1 FAMC @F{family_id_cache[parent.id]}@')
-                elif parent._partner and parent._partner in family_id_cache:
-                    working_text.append(f'\t1 FAMC @F{family_id_cache[parent._partner]}@')
-                else:
-                    working_text.append(f'\t1 FAMC @F{parent.tree_id}@')
-
-            # If you have children or a partner, generate a family
+                family = families.get(couple_key(i.parent))
+                if family is not None:
+                    yield f'\t1 FAMC @F{family[0]}@'
             if i._children or i._partner:
-                children = i.children
-                partner = i.partner
-
-                # See if you need to make a new family or be added to one already made
-                try:
-                    insert_location = gedcom_text.index(f'\t1 HUSB @I{i.tree_id}@')
-                    # Above will throw error if this user is not in a tree already
-
-                    working_text.append(f'\t1 FAMS @F{family_id_cache[partner.id]}@')
-                    family_id_cache[i.id] = partner.tree_id
-                    for c in children:
-                        gedcom_text.insert(insert_location, f'\t1 CHIL @I{c.tree_id}@')
-                except ValueError:
-                    family_id_cache[i.id] = i.tree_id
-                    working_text.append(f'\t1 FAMS @F{i.tree_id}@')
-                    working_text.append(f'0 @F{i.tree_id}@ FAM')
-                    working_text.append(f'\t1 WIFE @I{i.tree_id}@')
-                    if i.partner:
-                        working_text.append(f'\t1 HUSB @I{partner.tree_id}@')
-                    for c in children:
-                        working_text.append(f'\t1 CHIL @I{c.tree_id}@')
-
-            gedcom_text.extend(working_text)
-        x = '0 HEAD\n\t1 GEDC\n\t\t2 VERS 5.5\n\t\t2 FORM LINEAGE-LINKED\n\t1 CHAR UNICODE\n' + '\n'.join(gedcom_text) + '\n0 TRLR'
-        return x
-
-    def generational_span(self, people_dict:dict=None, depth:int=0, add_parent:bool=False, expand_upwards:bool=False, guild:Guild=None, all_people:list=None, recursive_depth:int=0) -> dict:
+                yield f'\t1 FAMS @F{families[couple_key(i)][0]}@'
+
+        # Add the families
+        for family_id, spouses, children in families.values():
+            yield f'0 @F{family_id}@ FAM'
+            yield f'\t1 WIFE @I{spouses[0].tree_id}@'
+            if len(spouses) > 1:
+                yield f'\t1 HUSB @I{spouses[1].tree_id}@'
+            for c in children:
+                yield f'\t1 CHIL @I{c.tree_id}@'
+        yield '0 TRLR'
+
+    def generational_span(self, add_parent:bool=False, expand_upwards:bool=False, guild:Guild=None, member_ids:typing.AbstractSet[int]=None, max_depth:int=None) -> dict:
         """
         Gets a list of every user related to this one
         If "add_parent" and "expand_upwards" are True, then it should add every user in a given tree,
         even if they're related through marriage's parents etc
 
         Params:
-            people_dict: dict
-                The dict of users who are currently in the tree (so as to avoid recursion)
-            depth: int = 0
-                The current generation of the tree span
             add_parent: bool = False
                 Whether or not to add the parent of this user to the people list
             expand_upwards: bool = False
                 Whether or not to expand upwards in the tree
             guild: Guild = None
                 If added, span will return users only if they're in the given guild
-            recursive_depth: int = 0
-                How far into the recursion you have gone - this is so we don't get recursion errors
+            member_ids: set = None
+                The IDs of the guild's members, if you've already got them
+            max_depth: int = None
+                How many generations down from this user to go before stopping
 
         Returns:
-            A list of all people on the family for this user, in no particular order
+            A dict of generation number: list of people in that generation
         """
 
-        # Don't add yourself again
-        if people_dict == None:
-            people_dict = {}
-        if all_people == None:
-            all_people = []
-        if self.id in all_people:
-            return people_dict
-        if recursive_depth >= 500:
-            return people_dict
-        all_people.append(self.id)
-
-        # Filter out non-guild members
-        if guild:
-            if not guild.get_member(self.id):
-                return people_dict
-
-        # Add to dict
-        x = people_dict.get(depth, list())
-        x.append(self)
-        people_dict[depth] = x
-
-        # Add your children
-        if self._children:
-            children = self.children
-            for child in children:
-                people_dict = child.generational_span(people_dict, depth=depth+1, add_parent=False, expand_upwards=expand_upwards, guild=guild, all_people=all_people, recursive_depth=recursive_depth+1)
+        if guild and member_ids is None:
+            member_ids = self.guild_members.get(guild)
+        people_dict = {}
+        all_people = set()
+        stack = [(self, 0, add_parent)]  # (user, depth, add_parent)
+
+        while stack:
+            person, depth, add_parent = stack.pop()
+
+            # Don't add anyone again
+            if person.id in all_people:
+                continue
+            all_people.add(person.id)
+
+            # Filter out non-guild members
+            if member_ids is not None and person.id not in member_ids:
+                continue
+
+            # Add to dict
+            x = people_dict.get(depth, list())
+            x.append(person)
+            people_dict[depth] = x
+
+            # Add their parent, partner, and children - in reverse, so the children come off the stack first
+            if expand_upwards and add_parent and person._parent:
+                stack.append((person.parent, depth - 1, True))
+            if person._partner:
+                stack.append((person.partner, depth, True))
+            if person._children and (max_depth is None or depth < max_depth):
+                stack.extend((child, depth + 1, False) for child in reversed(person.children))
 
-        # Add your partner
-        if self._partner:
-            partner = self.partner
-            people_dict = partner.generational_span(people_dict, depth=depth, add_parent=True, expand_upwards=expand_upwards, guild=guild, all_people=all_people, recursive_depth=recursive_depth+1)
+        return people_dict
 
-        # Add your parent
-        if expand_upwards and add_parent and self._parent:
-            parent = self.parent
-            people_dict = parent.generational_span(people_dict, depth=depth-1, add_parent=True, expand_upwards=expand_upwards, guild=guild, all_people=all_people, recursive_depth=recursive_depth+1)
+    def neighbourhood_generational_span(self, generations:int, guild:Guild=None, member_ids:typing.AbstractSet[int]=None) -> typing.Tuple[dict, typing.Dict[int, int]]:
+        """
+        Gets the generational span for just the people within a given amount of generations
+        of this user, rather than for their whole family
+        Only the people in that window are ever looked at, so it doesn't matter how big the family is
 
-        # Remove dupes, should they be in there
-        return people_dict
+        Params:
+            generations: int
+                How many generations up and down from this user to include
+            guild: Guild = None
+                If added, span will return users only if they're in the given guild
+            member_ids: set = None
+                The IDs of the guild's members, if you've already got them
+
+        Returns:
+            A dict of generation number: list of people in that generation, and a dict of
+            user ID: how many of their children were left out, for the people along the bottom
+        """
+
+        if guild and member_ids is None:
+            member_ids = self.guild_members.get(guild)
+
+        # Go up (at most) the given amount of generations and span down from there
+        root_user = self.get_root(member_ids=member_ids, max_generations=generations)
+        gen_span = root_user.generational_span(member_ids=member_ids, max_depth=generations * 2)
+        my_depth = next((depth for depth, people in gen_span.items() if self in people), 0)
+
+        # Cut off anyone too far below this user, counting the children that are left out
+        bottom_depth = my_depth + generations
+        gen_span = {depth: people for depth, people in gen_span.items() if depth <= bottom_depth}
+        collapsed = {}
+        for person in gen_span.get(bottom_depth, list()):
+            count = sum(1 for i in person._children if member_ids is None or i in member_ids)
+            if count:
+                collapsed[person.id] = count
+        return gen_span, collapsed
 
     async def to_dot_script(self, bot, guild:Guild=None, customised_tree_user:CustomisedTreeUser=None) -> str:
         """
@@ -408,26 +696,129 @@ class FamilyTreeMember(object):
                 members to the tree that are in the given guild
         """
 
-        # Get the generation spanning tree
-        root_user = self.get_root(guild=guild)
-        gen_span = root_user.generational_span(guild=guild)
-        return await self.to_dot_script_from_generational_span(bot, gen_span, customised_tree_user)
+        return await self._get_cached_dot_script(bot, guild, customised_tree_user, full=False)
 
     async def to_full_dot_script(self, bot, customised_tree_user:CustomisedTreeUser=None) -> str:
         """
         Gives you the string of the FULL current family
         """
 
+        return await self._get_cached_dot_script(bot, None, customised_tree_user, full=True)
+
+    async def _get_cached_dot_script(self, bot, guild:Guild, customised_tree_user:CustomisedTreeUser, full:bool) -> str:
+        """Gives you the DOT script for this user's tree, from the cache if nothing in the family has changed"""
+
+        # See if we've made this tree already
+        key = (self.id, self._guild_id)
+        guild_key = (guild.id, self.guild_members.version(guild.id)) if guild else None
+        cache_key = ('dot', key, guild_key, full, tuple(customised_tree_user.hex.values()), self.family_components.version(key))
+        if guild is not None and not self.guild_members.is_cacheable(guild):
+            cache_key = None
+        dot_script = self.tree_cache.get(cache_key) if cache_key else None
+        if dot_script is not None:
+            return dot_script
+
+        # Send big families off to another process, with the names of everyone who might be in the tree
+        if self.worker_pool is not None and self.worker_pool.should_offload(key):
+            member_ids = self.guild_members.get(guild) if guild and not full else None
+            user_ids = [i for i, _ in self.family_components.members(key) if member_ids is None or i in member_ids]
+            if member_ids is not None:
+                member_ids = frozenset(user_ids)
+                user_ids.extend(i for i in (self._partner, self._parent) if i and i not in member_ids)  # These are always added
+            names = dict(zip(user_ids, await asyncio.gather(*[bot.get_name(i) for i in user_ids])))
+            dot_script = await self.worker_pool.generate_dot_script(self, member_ids, full, customised_tree_user.hex, names)
+            if cache_key:
+                self.tree_cache.set(cache_key, dot_script, len(dot_script))
+            return dot_script
+
         # Get the generation spanning tree
-        root_user = self.get_root()
-        gen_span = root_user.generational_span(expand_upwards=True, add_parent=True)
-        return await self.to_dot_script_from_generational_span(bot, gen_span, customised_tree_user)
+        gen_span = self.get_tree_generational_span(guild, full)
+        dot_script = await self.to_dot_script_from_generational_span(bot, gen_span, customised_tree_user)
+        if cache_key:
+            self.tree_cache.set(cache_key, dot_script, len(dot_script))
+        return dot_script
+
+    def get_tree_generational_span(self, guild:Guild=None, full:bool=False) -> dict:
+        """Gives you the (cached) generational span that this user's tree is drawn from
+
+        Params:
+            guild: Guild = None
+                If set, only members of the guild are included
+            full: bool = False
+                Whether to include everyone in the family, as with to_full_dot_script
+        """
+
+        if full:
+            root_user = self.get_root()
+            return root_user.cached_generational_span(expand_upwards=True, add_parent=True)
+        member_ids = self.guild_members.get(guild) if guild else None
+        root_user = self.get_root(guild=guild, member_ids=member_ids)
+        return root_user.cached_generational_span(guild=guild, member_ids=member_ids)
+
+    async def to_neighbourhood_dot_script(self, bot, generations:int, guild:Guild=None, customised_tree_user:CustomisedTreeUser=None) -> str:
+        """
+        Gives you the DOT script for just the people within a given amount of generations of this user
+
+        Params:
+            bot: Bot
+                Used solely to get the names of people
+            generations: int
+                How many generations up and down from this user to include
+            guild: Guild = None
+                If set to a guild, will only add members to the tree that are in the given guild
+        """
+
+        # See if we've made this tree already
+        key = (self.id, self._guild_id)
+        guild_key = (guild.id, self.guild_members.version(guild.id)) if guild else None
+        cache_key = ('neighbourhood', key, guild_key, generations, tuple(customised_tree_user.hex.values()), self.family_components.version(key))
+        if guild is not None and not self.guild_members.is_cacheable(guild):
+            cache_key = None
+        dot_script = self.tree_cache.get(cache_key) if cache_key else None
+        if dot_script is not None:
+            return dot_script
+
+        # Make the tree
+        gen_span, collapsed = self.neighbourhood_generational_span(generations, guild=guild)
+        names = await self.get_generational_span_names(bot, gen_span)
+        dot_script = self.build_dot_script(gen_span, customised_tree_user.hex, names, collapsed)
+        if cache_key:
+            self.tree_cache.set(cache_key, dot_script, len(dot_script))
+        return dot_script
+
+    def cached_generational_span(self, add_parent:bool=False, expand_upwards:bool=False, guild:Guild=None, member_ids:typing.AbstractSet[int]=None) -> dict:
+        """The same as generational_span, but cached against the version of the family (and of the
+        guild's member list, for guilds that have finished chunking)
+        Gives you a copy of the cached span, so it's safe to change"""
+
+        if guild is not None and not self.guild_members.is_cacheable(guild):
+            return self.generational_span(add_parent=add_parent, expand_upwards=expand_upwards, guild=guild, member_ids=member_ids)
+        key = (self.id, self._guild_id)
+        guild_key = (guild.id, self.guild_members.version(guild.id)) if guild else None
+        cache_key = ('span', key, guild_key, add_parent, expand_upwards, self.family_components.version(key))
+        gen_span = self.tree_cache.get(cache_key)
+        if gen_span is None:
+            gen_span = self.generational_span(add_parent=add_parent, expand_upwards=expand_upwards, guild=guild, member_ids=member_ids)
+            self.tree_cache.set(cache_key, gen_span, 64 * sum(len(i) for i in gen_span.values()))
+        return {depth: list(people) for depth, people in gen_span.items()}
 
     async def to_dot_script_from_generational_span(self, bot, gen_span:dict, customised_tree_user:CustomisedTreeUser) -> str:
         """Generates the DOT script from a given generational span"""
 
-        ctu = customised_tree_user  # Shorten this variable name
-        gen_span: typing.Dict[int, typing.List[self.__class__]] = gen_span  # Just set up some type hinting
+        names = await self.get_generational_span_names(bot, gen_span)
+        return self.build_dot_script(gen_span, customised_tree_user.hex, names)
+
+    async def get_generational_span_names(self, bot, gen_span:dict) -> typing.Dict[int, str]:
+        """Gets the names of everyone in a generational span (plus this user's partner and parent) all at once"""
+
+        user_ids = {i.id: None for generation in gen_span.values() for i in generation}
+        user_ids.update({i: None for i in (self._partner, self._parent) if i})
+        user_ids = list(user_ids)
+        return dict(zip(user_ids, await asyncio.gather(*[bot.get_name(i) for i in user_ids])))
+
+    def add_partner_and_parent(self, gen_span:dict) -> None:
+        """Adds this user's partner and parent into a generational span, if they're not already in it,
+        since they're always shown on the user's tree"""
 
         # Find my own depth
         my_depth: int = None
@@ -450,29 +841,40 @@ class FamilyTreeMember(object):
                 x.append(parent)
                 gen_span[my_depth-1] = x
 
+    def build_dot_script(self, gen_span:dict, ctu_hex:dict, names:typing.Dict[int, str], collapsed:typing.Dict[int, int]=None) -> str:
+        """Generates the DOT script from a given generational span, given the names of everyone in it
+        and the hex colours from the user's CustomisedTreeUser
+        Anyone in "collapsed" gets a "+k more" marker underneath them for the children that were left out"""
+
+        gen_span: typing.Dict[int, typing.List[self.__class__]] = gen_span  # Just set up some type hinting
+        self.add_partner_and_parent(gen_span)
+
         # Make some initial digraph stuff
-        all_text: str = (
+        all_text: typing.List[str] = [
             'digraph {'
-            f"node [shape=box, fontcolor={ctu.hex['font']}, color={ctu.hex['edge']}, fillcolor={ctu.hex['node']}, style=filled];"
-            f"edge [dir=none, color={ctu.hex['edge']}];"
-            f"bgcolor={ctu.hex['background']};"
-            f"rankdir={ctu.hex['direction']};"
-        )
+            f"node [shape=box, fontcolor={ctu_hex['font']}, color={ctu_hex['edge']}, fillcolor={ctu_hex['node']}, style=filled];"
+            f"edge [dir=none, color={ctu_hex['edge']}];"
+            f"bgcolor={ctu_hex['background']};"
+            f"rankdir={ctu_hex['direction']};"
+        ]
 
         # Set up some stuff for later
-        all_users: typing.List[self.__class__] = []
-        user_parent_tree: typing.Dict[self.__class__: str] = {}  # Connects a parent to a random string used to connect the children
+        all_users: typing.List[self.__class__] = [i for generation in gen_span.values() for i in generation]
+        all_users_set: typing.Set[self.__class__] = set(all_users)
+        user_parent_tree: typing.Dict[self.__class__: str] = {}  # Connects a parent to the node used to connect the children
 
         # Add the username for each user (from unflattened list)
-        for generation in gen_span.values():
-            for i in generation:
-                all_users.append(i)
-                name = await bot.get_name(i.id)
-                name = name.replace('"', '\\"')
-                if i == self:
-                    all_text += f'{i.id}[label="{name}", fillcolor={ctu.hex["highlighted_node"]}, fontcolor={ctu.hex["highlighted_font"]}];'
-                else:
-                    all_text += f'{i.id}[label="{name}"];'
+        for i in all_users:
+            name = names[i.id].replace('"', '\\"')
+            if i == self:
+                all_text.append(f'{i.id}[label="{name}", fillcolor={ctu_hex["highlighted_node"]}, fontcolor={ctu_hex["highlighted_font"]}];')
+            else:
+                all_text.append(f'{i.id}[label="{name}"];')
+
+        # Add markers for the children that aren't in the tree
+        for user_id, count in (collapsed or dict()).items():
+            all_text.append(f'more{user_id}[label="+{count} more", shape=plaintext, style="", fontcolor={ctu_hex["edge"]}];')
+            all_text.append(f'{user_id} -> more{user_id} [style=dashed];')
 
         # Order the generations
         generation_numbers: typing.List[int] = sorted(list(gen_span.keys()))  # The ordered list of generation numbers - just a list of sequential numbers
@@ -480,12 +882,13 @@ class FamilyTreeMember(object):
         # Go through the members for each generation
         for generation_number in generation_numbers:
             generation = gen_span.get(generation_number)
+            generation_set = set(generation)
 
             # Make sure you don't add a spouse twice
-            added_already: typing.List[self.__class__] = []
+            added_already: typing.Set[self.__class__] = set()
 
             # Add a ranking for this generation
-            all_text += "{rank=same;"
+            all_text.append("{rank=same;")
 
             # Add linking
             previous_person = None
@@ -496,7 +899,7 @@ class FamilyTreeMember(object):
                 # Don't add a person twice
                 if person in added_already:
                     continue
-                added_already.append(person)
+                added_already.add(person)
                 partner = person.partner
 
                 # Give them something in the dict so it doesn't make a keyerror
@@ -504,49 +907,50 @@ class FamilyTreeMember(object):
 
                 # Make sure they stay in line
                 if previous_person:
-                    all_text += f"{previous_person.id} -> {person.id} [style=invis];"
+                    all_text.append(f"{previous_person.id} -> {person.id} [style=invis];")
 
                 # Add the user and their partner
-                if partner and partner in generation:
+                if partner and partner in generation_set:
 
-                    # Set their user parent tree so they share a family value
-                    user_parent_tree[partner.id] = user_parent_tree[person.id] = get_random_string()
+                    # Set their user parent tree so they share a family value - this is made from their IDs
+                    # so the same tree always gives the same DOT code, and so the same render cache key
+                    user_parent_tree[partner.id] = user_parent_tree[person.id] = f"c{min(person.id, partner.id)}_{max(person.id, partner.id)}"
 
                     # Add the users and family value
-                    all_text += f"{person.id} -> {user_parent_tree[person.id]} -> {partner.id};"
-                    all_text += f"{user_parent_tree[person.id]} {self.INVISIBLE};"
-                    added_already.append(partner)
+                    all_text.append(f"{person.id} -> {user_parent_tree[person.id]} -> {partner.id};")
+                    all_text.append(f"{user_parent_tree[person.id]} {self.INVISIBLE};")
+                    added_already.add(partner)
                     previous_person = partner
 
                 # No partner? No problem
                 else:
-                    all_text += f"{person.id};"
+                    all_text.append(f"{person.id};")
                     previous_person = person
 
             # Close off the generation and open a new ranking for adding children
-            all_text += "}{"
+            all_text.append("}{")
 
             # Go through the people in the generation and add add links
             for person in generation:
                 if person._children:
                     children: typing.List[self.__class__] = person.children
-                    if any([i in all_users for i in children]):
-                        all_text += f"h{user_parent_tree[person.id]} {self.INVISIBLE};"
-            all_text += "}"
+                    if any(i in all_users_set for i in children):
+                        all_text.append(f"h{user_parent_tree[person.id]} {self.INVISIBLE};")
+            all_text.append("}")
 
             # Add the lines from parent to node to child
-            added_already.clear()
+            added_trees: typing.Set[str] = set()
             for person in generation:
                 if person._children:
                     children = person.children
-                    if any([i in all_users for i in children]):
-                        if user_parent_tree[person.id] in added_already:
+                    if any(i in all_users_set for i in children):
+                        if user_parent_tree[person.id] in added_trees:
                             pass
                         else:
-                            all_text += f"\t\t{user_parent_tree[person.id]} -> h{user_parent_tree[person.id]};"
-                            added_already.append(user_parent_tree[person.id])
-                        for child in [i for i in children if i in all_users]:
-                            all_text += f"\t\th{user_parent_tree[person.id]} -> {child.id};"
-        all_text += "}"
+                            all_text.append(f"\t\t{user_parent_tree[person.id]} -> h{user_parent_tree[person.id]};")
+                            added_trees.add(user_parent_tree[person.id])
+                        for child in [i for i in children if i in all_users_set]:
+                            all_text.append(f"\t\th{user_parent_tree[person.id]} -> {child.id};")
+        all_text.append("}")
 
-        return all_text
+        return ''.join(all_text)
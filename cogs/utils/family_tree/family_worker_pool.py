@@ -0,0 +1,141 @@
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import typing
+
+from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
+from cogs.utils.family_tree.family_component_index import FamilyComponentIndex
+from cogs.utils.family_tree.ancestor_index import AncestorIndex
+
+
+MemberKey = typing.Tuple[int, int]  # (discord_id, guild_id)
+FamilySnapshot = typing.Tuple[int, typing.List[typing.Tuple[int, typing.List[int], typing.Optional[int], typing.Optional[int]]]]  # (guild_id, [(discord_id, children, parent_id, partner_id), ...])
+FamilyVersion = typing.Tuple[int, int]  # (ID of the main process' FamilyComponentIndex, version of the family)
+
+_loaded_version: typing.Optional[FamilyVersion] = None  # Which family this (worker) process has loaded
+
+
+class _SnapshotMissing(object):
+    """Given back by a worker that was sent a job without a snapshot for a family it doesn't have loaded"""
+
+
+def _load_snapshot(snapshot:FamilySnapshot) -> None:
+    """Replaces the whole family tree in this (worker) process with the given snapshot"""
+
+    FamilyTreeMember.all_users = {}
+    FamilyTreeMember.family_components = FamilyComponentIndex()
+    FamilyTreeMember.ancestors = AncestorIndex()
+    guild_id, users = snapshot
+    for discord_id, children, parent_id, partner_id in users:
+        FamilyTreeMember(discord_id=discord_id, children=children, parent_id=parent_id, partner_id=partner_id, guild_id=guild_id)
+
+
+def _run_on_family(version:FamilyVersion, snapshot:typing.Optional[FamilySnapshot], function:typing.Callable, *args):
+    """Runs a function inside a worker process once the given version of a family is loaded,
+    only loading the snapshot if it's a different family to the last job's"""
+
+    global _loaded_version
+    if _loaded_version != version:
+        if snapshot is None:
+            return _SnapshotMissing()
+        _loaded_version = None  # In case loading it fails part of the way through
+        _load_snapshot(snapshot)
+        _loaded_version = version
+    return function(*args)
+
+
+def _generate_dot_script(guild_id:int, user_id:int, member_ids:typing.Optional[typing.FrozenSet[int]], full:bool, ctu_hex:dict, names:typing.Dict[int, str]) -> str:
+    """Generates a DOT script inside a worker process"""
+
+    user = FamilyTreeMember.get(user_id, guild_id)
+    if full:
+        root_user = user.get_root()
+        gen_span = root_user.generational_span(expand_upwards=True, add_parent=True)
+    else:
+        root_user = user.get_root(member_ids=member_ids)
+        gen_span = root_user.generational_span(member_ids=member_ids)
+    return user.build_dot_script(gen_span, ctu_hex, names)
+
+
+def _get_relation(guild_id:int, user_id:int, target_id:int) -> typing.Optional[str]:
+    """Gets the relation between two users inside a worker process"""
+
+    user = FamilyTreeMember.get(user_id, guild_id)
+    return user.get_relation(FamilyTreeMember.get(target_id, guild_id))
+
+
+class FamilyWorkerPool(object):
+    """A pool of processes that big families get sent off to, so that walking them and
+    generating their trees doesn't block the event loop for everyone else
+
+    The worker processes don't have their own copy of the tree, so each one keeps hold of the
+    last family it was sent. Jobs are sent without a snapshot first, and only sent again with a
+    snapshot of the family if the worker they landed on doesn't have that version of it already
+
+    The workers are started through a forkserver (or spawned, where there isn't one) rather than
+    being forked from the bot's process, so they don't inherit its event loop and connections
+
+    Params:
+        max_workers: int
+            How many processes to run
+        threshold: int
+            How big a family needs to be before it's sent to the pool rather than being done inline
+    """
+
+    def __init__(self, max_workers:int, threshold:int):
+        self.threshold = threshold
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context('spawn')
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+    def should_offload(self, key:MemberKey) -> bool:
+        """Whether or not the given user's family is big enough to be sent to the pool"""
+
+        return FamilyTreeMember.family_components.size(key) >= self.threshold
+
+    def take_snapshot(self, key:MemberKey) -> FamilySnapshot:
+        """Gives you a picklable copy of the given user's family"""
+
+        users = []
+        for member_key in FamilyTreeMember.family_components.members(key):
+            user = FamilyTreeMember.all_users.get(member_key)
+            if user is not None:
+                users.append((user.id, list(user._children), user._parent, user._partner))
+        return (key[1], users)
+
+    async def run(self, function:typing.Callable, *args):
+        """Runs a function in the pool, waiting for its result"""
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def run_on_family(self, key:MemberKey, function:typing.Callable, *args):
+        """Runs a function in the pool with the given user's family loaded in the worker, only sending
+        the family over if the worker doesn't have it already"""
+
+        version = (id(FamilyTreeMember.family_components), FamilyTreeMember.family_components.version(key))
+        result = await self.run(_run_on_family, version, None, function, *args)
+        if isinstance(result, _SnapshotMissing):
+            result = await self.run(_run_on_family, version, self.take_snapshot(key), function, *args)
+        return result
+
+    async def generate_dot_script(self, user:FamilyTreeMember, member_ids:typing.Optional[typing.FrozenSet[int]], full:bool, ctu_hex:dict, names:typing.Dict[int, str]) -> str:
+        """Generates the DOT script for a given user in the pool - see FamilyTreeMember.build_dot_script"""
+
+        key = (user.id, user._guild_id)
+        return await self.run_on_family(key, _generate_dot_script, user._guild_id, user.id, member_ids, full, ctu_hex, names)
+
+    async def get_relation(self, user:FamilyTreeMember, target_user:FamilyTreeMember) -> typing.Optional[str]:
+        """Gets the relation between two users in the pool - see FamilyTreeMember.get_relation"""
+
+        key = (user.id, user._guild_id)
+        return await self.run_on_family(key, _get_relation, user._guild_id, user.id, target_user.id)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes"""
+
+        self.executor.shutdown(wait=False)
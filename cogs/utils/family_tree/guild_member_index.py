@@ -0,0 +1,56 @@
+import itertools
+import typing
+
+from discord import Guild
+
+
+class GuildMemberIndex(object):
+    """Caches a frozen set of the member IDs of each guild, so that guild-filtered trees can do a
+    set lookup for each user rather than going through guild.get_member every time
+
+    Each guild's set has a version number that changes whenever the set is thrown away (eg someone
+    joins or leaves), so that trees filtered by the guild can be cached against it
+    """
+
+    __slots__ = ('_member_ids', '_versions', '_version_counter')
+
+    def __init__(self):
+        self._member_ids: typing.Dict[int, typing.FrozenSet[int]] = {}  # GuildID: member IDs
+        self._versions: typing.Dict[int, int] = {}  # GuildID: version
+        self._version_counter = itertools.count(1)
+
+    def clear(self) -> None:
+        """Removes everything from the index"""
+
+        self._member_ids.clear()
+        self._versions.clear()
+
+    def get(self, guild:Guild) -> typing.FrozenSet[int]:
+        """Gives you the IDs of every member of the given guild
+        Guilds that haven't finished chunking aren't cached, since their member list isn't complete yet"""
+
+        member_ids = self._member_ids.get(guild.id)
+        if member_ids is not None:
+            return member_ids
+        member_ids = frozenset(i.id for i in guild.members)
+        if guild.chunked:
+            self._member_ids[guild.id] = member_ids
+        return member_ids
+
+    def version(self, guild_id:int) -> int:
+        """Gives you the version of the given guild's member list"""
+
+        return self._versions.get(guild_id, 0)
+
+    def is_cacheable(self, guild:Guild) -> bool:
+        """Whether or not trees filtered by the given guild can be cached against its version
+        Guilds that haven't finished chunking can gain members without their version changing"""
+
+        return guild.chunked
+
+    def invalidate(self, guild_id:int) -> None:
+        """Throws away the cached member list for a guild, bumping its version
+        Should be called whenever someone joins or leaves the guild"""
+
+        self._member_ids.pop(guild_id, None)
+        self._versions[guild_id] = next(self._version_counter)
@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import itertools
+import typing
+
+from cogs.utils.database import DatabaseConnection
+from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
+
+
+MemberKey = typing.Tuple[int, int]  # (discord_id, guild_id)
+
+
+class LazyFamilyLoader(object):
+    """Loads families from the database only when they're needed, rather than keeping every
+    family in memory all of the time
+
+    A user's whole family is loaded in one go with a recursive query, so that anything loaded is always
+    complete. Families are forgotten about again, least recently used first, once there are more than
+    the maximum amount of users loaded. Families that are pinned (eg by a command that's still running
+    and holding onto their FamilyTreeMember objects) are never forgotten about until they're unpinned.
+
+    Params:
+        max_users: int
+            How many users can be loaded before old families start to be forgotten
+    """
+
+    # Each step of the recursion looks up one user's partner, children and parent, with the guild ID and
+    # user ID both in the join, so that every lookup is an index scan on marriages_pkey, parents_pkey or
+    # parents_parent_id_guild_id rather than a scan of the whole guild's relationships
+    # EXPLAIN of this on a copy of the live tables should show an Index Scan (or Index Only Scan) for
+    # all three of the lookups inside the recursive union, and for the two at the end
+    FAMILY_SQL = '''WITH RECURSIVE family (user_id) AS (
+        SELECT $1::BIGINT
+        UNION SELECT step.other_id FROM family, LATERAL (
+            SELECT partner_id FROM marriages WHERE user_id=family.user_id AND guild_id=$2
+            UNION ALL SELECT child_id FROM parents WHERE parent_id=family.user_id AND guild_id=$2
+            UNION ALL SELECT parent_id FROM parents WHERE child_id=family.user_id AND guild_id=$2
+        ) step (other_id)
+    )
+    SELECT 'marriage' AS kind, marriages.user_id, marriages.partner_id AS other_id FROM family JOIN marriages ON marriages.user_id=family.user_id AND marriages.guild_id=$2
+    UNION ALL SELECT 'parent', parents.parent_id, parents.child_id FROM family JOIN parents ON parents.child_id=family.user_id AND parents.guild_id=$2'''
+
+    def __init__(self, max_users:int):
+        self.max_users = max_users
+        self._groups: typing.Dict[int, typing.Set[MemberKey]] = collections.OrderedDict()  # Group ID: keys, for every load - least recently used first
+        self._group_of: typing.Dict[MemberKey, int] = {}  # Key: group ID
+        self._loading: typing.Dict[MemberKey, asyncio.Future] = {}  # Key: the load that's currently running for it
+        self._pinned: typing.Dict[MemberKey, int] = collections.Counter()  # Key: how many times it's been pinned
+        self._group_counter = itertools.count()
+        self._generation = 0  # Bumped on clear, so loads from before then are thrown away
+
+    def __len__(self) -> int:
+        return len(self._group_of)
+
+    def __contains__(self, key:MemberKey) -> bool:
+        return key in self._group_of
+
+    def clear(self) -> None:
+        """Forgets about everything that's been loaded, including any loads that are still running
+        This doesn't remove anything from FamilyTreeMember.all_users"""
+
+        self._groups.clear()
+        self._group_of.clear()
+        self._loading.clear()
+        self._generation += 1
+
+    def pin(self, keys:typing.Iterable[MemberKey]) -> None:
+        """Stops the families of the given users from being forgotten about until they're unpinned"""
+
+        self._pinned.update(keys)
+
+    def unpin(self, keys:typing.Iterable[MemberKey]) -> None:
+        """Lets the families of the given users be forgotten about again"""
+
+        for i in keys:
+            self._pinned[i] -= 1
+            if self._pinned[i] <= 0:
+                del self._pinned[i]
+
+    async def load(self, key:MemberKey) -> None:
+        """Makes sure the given user's whole family is in memory, loading it from the database if it isn't
+
+        Params:
+            key: MemberKey
+                The (discord_id, guild_id) key of the user
+        """
+
+        # See if it's already here
+        group_id = self._group_of.get(key)
+        if group_id is not None:
+            self._groups.move_to_end(group_id)
+            return
+
+        # Share the load with anyone else waiting on the same user
+        future = self._loading.get(key)
+        if future is None:
+            future = self._loading[key] = asyncio.ensure_future(self._load(key))
+            future.add_done_callback(lambda f: self._loading.pop(key, None) if self._loading.get(key) is f else None)
+        await future
+
+    async def _load(self, key:MemberKey) -> None:
+        """Loads a user's family from the database into FamilyTreeMember.all_users"""
+
+        discord_id, guild_id = key
+        generation = self._generation
+        async with DatabaseConnection() as db:
+            rows = await db(self.FAMILY_SQL, discord_id, guild_id)
+        if generation != self._generation:
+            return  # Everything was cleared while we were waiting
+        if key in self._group_of:
+            return  # Someone else in the family loaded it while we were waiting
+
+        # Add the family to the tree
+        FamilyTreeMember.add_relations(
+            [(i['user_id'], i['other_id'], guild_id) for i in rows if i['kind'] == 'marriage'],
+            [(i['user_id'], i['other_id'], guild_id) for i in rows if i['kind'] == 'parent'],
+        )
+        keys = {key}
+        keys.update((i['user_id'], guild_id) for i in rows)
+        keys.update((i['other_id'], guild_id) for i in rows)
+
+        # Store them as a group
+        group_id = next(self._group_counter)
+        self._groups[group_id] = keys
+        for i in keys:
+            old_group = self._groups.get(self._group_of.get(i))
+            if old_group is not None:
+                old_group.discard(i)
+            self._group_of[i] = group_id
+
+        # Forget about old families, other than the one that was just loaded and any that are pinned
+        if len(self._group_of) <= self.max_users:
+            return
+        pinned_components = {FamilyTreeMember.family_components.component_id(i) for i in self._pinned}
+        pinned_components.discard(None)
+        for old_group_id in list(self._groups)[:-1]:
+            if len(self._group_of) <= self.max_users:
+                break
+            old_keys = self._groups[old_group_id]
+            if any(i in self._pinned or FamilyTreeMember.family_components.component_id(i) in pinned_components for i in old_keys):
+                continue
+            del self._groups[old_group_id]
+            for i in list(old_keys):
+                if i in self._group_of:
+                    self.evict(i)
+
+    def evict(self, key:MemberKey) -> None:
+        """Removes the given user's whole family from memory, so it'll be loaded again next time it's needed"""
+
+        for i in list(FamilyTreeMember.family_components.members(key)):
+            FamilyTreeMember.all_users.pop(i, None)
+            FamilyTreeMember.ancestors.invalidate(i)
+            group = self._groups.get(self._group_of.pop(i, None))
+            if group is not None:
+                group.discard(i)
+        FamilyTreeMember.family_components.discard(key)
+
+    def apply_update(self, data:dict) -> None:
+        """Applies a TreeMemberUpdate from another shard, but only if it's about a family that's loaded
+        If it links a loaded family to one that isn't, the loaded family is thrown away instead, since
+        it's no longer complete
+
+        Params:
+            data: dict
+                The JSON of the updated FamilyTreeMember
+        """
+
+        guild_id = data.get('guild_id', 0)
+        user_ids = [data['discord_id'], data.get('parent_id'), data.get('partner_id')] + list(data.get('children') or [])
+        involved = [(i, guild_id) for i in user_ids if i]
+        loaded = [i for i in involved if i in self._group_of]
+        if not loaded:
+            return
+        if len(loaded) == len(involved):
+            FamilyTreeMember.from_json(data)
+            return
+        for i in loaded:
+            if i in self._group_of:
+                self.evict(i)
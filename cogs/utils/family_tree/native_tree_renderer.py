@@ -0,0 +1,239 @@
+import html
+import io
+import itertools
+import typing
+
+from PIL import Image, ImageDraw, ImageFont
+
+from cogs.utils.customised_tree_user import CustomisedTreeUser
+from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
+
+
+Point = typing.Tuple[float, float]
+NodeBox = typing.Tuple[float, float, float]  # (x, y, width)
+
+
+class NativeTreeRenderer(object):
+    """Lays out and draws small family trees in-process, rather than starting up Graphviz for them
+
+    Each generation from the generational span gets a row of its own, with partners next to each
+    other and children placed as close to underneath their parents as they'll fit
+
+    Params:
+        max_size: int
+            How many people can be in a family for it to be drawn here rather than by Graphviz
+        font_path: str = None
+            A TrueType font to draw names with - the built-in one only covers basic Latin, so names
+            with any characters that the font can't draw are left to Graphviz
+    """
+
+    NODE_HEIGHT = 30
+    NODE_PADDING = 10  # Space either side of a name
+    PARTNER_GAP = 30  # Space between partners
+    UNIT_GAP = 20  # Space between people (or couples) in the same generation
+    GENERATION_GAP = 50  # Space between generations
+    MARGIN = 10
+    FONT_SIZE = 14
+
+    def __init__(self, max_size:int, font_path:str=None):
+        self.max_size = max_size
+        if font_path:
+            self.font = ImageFont.truetype(font_path, self.FONT_SIZE)
+        else:
+            try:
+                self.font = ImageFont.load_default(self.FONT_SIZE)
+            except TypeError:
+                self.font = ImageFont.load_default()  # Pillow before 10.1 only has the one small bitmap font
+        missing_glyph = self.font.getmask('\U0010FFFD')  # A private use character, so it'll be drawn as the font's missing glyph
+        self._missing_glyph = (missing_glyph.size, bytes(missing_glyph))
+        self._has_glyph: typing.Dict[str, bool] = {}  # Character: whether the font can draw it
+
+    def can_render(self, user:FamilyTreeMember, customised_tree_user:CustomisedTreeUser) -> bool:
+        """Whether or not the given user's tree is small and simple enough to be drawn in-process"""
+
+        if customised_tree_user.direction != 'TB':
+            return False  # Only Graphviz does the other directions
+        key = (user.id, user._guild_id)
+        if not FamilyTreeMember.family_components.is_tree(key):
+            return False  # People can turn up in more than one generation when there are loops
+        return FamilyTreeMember.family_components.size(key) <= self.max_size
+
+    def can_draw(self, names:typing.Iterable[str]) -> bool:
+        """Whether or not the renderer's font has every character in the given names"""
+
+        for character in set(''.join(names)):
+            if character.isspace():
+                continue
+            has_glyph = self._has_glyph.get(character)
+            if has_glyph is None:
+                mask = self.font.getmask(character)
+                has_glyph = self._has_glyph[character] = (mask.size, bytes(mask)) != self._missing_glyph
+            if not has_glyph:
+                return False
+        return True
+
+    @staticmethod
+    def get_colour(quoted_hex:str) -> typing.Optional[str]:
+        """Turns one of the colours from CustomisedTreeUser.hex into a hex string, or None if it's transparent"""
+
+        colour = quoted_hex.strip('"')
+        if colour == 'transparent':
+            return None
+        return colour
+
+    def get_text_size(self, text:str) -> typing.Tuple[int, int]:
+        """Gives you the (width, height) of some text in the renderer's font"""
+
+        left, top, right, bottom = self.font.getbbox(text)
+        return right - left, bottom - top
+
+    def layout(self, gen_span:dict, names:typing.Dict[int, str]) -> typing.Tuple[float, float, typing.Dict[int, NodeBox], typing.List[typing.List[Point]]]:
+        """Works out where everyone in a generational span goes
+
+        Returns:
+            The (width, height) of the image, a dict of user ID: (x, y, width) for each box,
+            and a list of the lines joining them
+        """
+
+        nodes: typing.Dict[int, NodeBox] = {}
+        unit_of: typing.Dict[int, typing.Tuple[int, ...]] = {}  # User ID: the IDs of them and their partner
+        lines: typing.List[typing.List[Point]] = []
+        width = 0
+
+        placed: typing.Set[int] = set()  # Everyone who's got a row already
+        for row, depth in enumerate(sorted(gen_span)):
+            generation = [i for i in gen_span[depth] if i.id not in placed]
+            placed.update(i.id for i in generation)
+            people = {i.id: i for i in generation}
+            y = self.MARGIN + row * (self.NODE_HEIGHT + self.GENERATION_GAP)
+
+            # Pair everyone up with their partner
+            units: typing.List[typing.Tuple[int, ...]] = []
+            added_already: typing.Set[int] = set()
+            for person in generation:
+                if person.id in added_already:
+                    continue
+                if person._partner and person._partner in people and person._partner not in added_already:
+                    unit = (person.id, person._partner)
+                else:
+                    unit = (person.id,)
+                added_already.update(unit)
+                units.append(unit)
+                for i in unit:
+                    unit_of[i] = unit
+
+            # Group them by their parents, ordered by where their parents were put
+            parent_units: typing.Dict[typing.Tuple[int, ...], typing.Optional[typing.Tuple[int, ...]]] = {}
+            child_of_unit: typing.Dict[typing.Tuple[int, ...], int] = {}  # Unit: the ID of whichever of them is the child
+            for unit in units:
+                parent_units[unit] = None
+                for user_id in unit:
+                    parent_id = people[user_id]._parent
+                    if parent_id and parent_id in nodes:
+                        parent_units[unit] = unit_of[parent_id]
+                        child_of_unit[unit] = user_id
+                        break
+            units.sort(key=lambda unit: self.get_connector(parent_units[unit], nodes)[0] if parent_units[unit] else float('inf'))
+
+            # Place each family of children as close to underneath its parents as possible
+            right = self.MARGIN - self.UNIT_GAP
+            for parent_unit, family in itertools.groupby(units, key=parent_units.get):
+                family = list(family)
+                unit_widths = [[self.get_text_size(names[i])[0] + self.NODE_PADDING * 2 for i in unit] for unit in family]
+                family_width = sum(sum(i) + self.PARTNER_GAP * (len(i) - 1) for i in unit_widths) + self.UNIT_GAP * (len(family) - 1)
+                x = right + self.UNIT_GAP
+                if parent_unit is not None:
+                    x = max(x, self.get_connector(parent_unit, nodes)[0] - family_width / 2)
+                for unit, widths in zip(family, unit_widths):
+                    for user_id, node_width in zip(unit, widths):
+                        nodes[user_id] = (x, y, node_width)
+                        x += node_width + self.PARTNER_GAP
+                    x -= self.PARTNER_GAP
+                    if len(unit) == 2:
+                        first, second = nodes[unit[0]], nodes[unit[1]]
+                        lines.append([(first[0] + first[2], y + self.NODE_HEIGHT / 2), (second[0], y + self.NODE_HEIGHT / 2)])
+                    right = x
+                    x += self.UNIT_GAP
+
+                # Join them to their parents
+                if parent_unit is not None:
+                    parent_x, parent_y = self.get_connector(parent_unit, nodes)
+                    bar_y = y - self.GENERATION_GAP / 2
+                    child_xs = [nodes[child_of_unit[unit]][0] + nodes[child_of_unit[unit]][2] / 2 for unit in family]
+                    lines.append([(parent_x, parent_y), (parent_x, bar_y)])
+                    lines.append([(min(child_xs + [parent_x]), bar_y), (max(child_xs + [parent_x]), bar_y)])
+                    lines.extend([(i, bar_y), (i, y)] for i in child_xs)
+            width = max(width, right)
+
+        height = self.MARGIN * 2 + len(gen_span) * self.NODE_HEIGHT + (len(gen_span) - 1) * self.GENERATION_GAP
+        return width + self.MARGIN, height, nodes, lines
+
+    def get_connector(self, unit:typing.Tuple[int, ...], nodes:typing.Dict[int, NodeBox]) -> Point:
+        """Gives you the point that a person's (or couple's) children are joined to"""
+
+        if len(unit) == 2:
+            first, second = nodes[unit[0]], nodes[unit[1]]
+            return (first[0] + first[2] + second[0]) / 2, first[1] + self.NODE_HEIGHT / 2
+        x, y, width = nodes[unit[0]]
+        return x + width / 2, y + self.NODE_HEIGHT
+
+    def render_png(self, user:FamilyTreeMember, gen_span:dict, ctu_hex:dict, names:typing.Dict[int, str]) -> bytes:
+        """Draws a generational span as a PNG
+
+        Params:
+            user: FamilyTreeMember
+                The user whose tree it is - they get highlighted
+            gen_span: dict
+                The generational span to draw, with the user's partner and parent added
+            ctu_hex: dict
+                The hex colours from the user's CustomisedTreeUser
+            names: dict
+                The names of everyone in the tree
+        """
+
+        width, height, nodes, lines = self.layout(gen_span, names)
+        background = self.get_colour(ctu_hex['background'])
+        edge = self.get_colour(ctu_hex['edge'])
+        image = Image.new('RGB' if background else 'RGBA', (int(width), int(height)), background or (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+
+        # Draw the lines
+        if edge is not None:
+            for line in lines:
+                draw.line(line, fill=edge)
+
+        # Draw the people
+        for user_id, (x, y, node_width) in nodes.items():
+            highlighted = user_id == user.id
+            fill = self.get_colour(ctu_hex['highlighted_node' if highlighted else 'node'])
+            font_colour = self.get_colour(ctu_hex['highlighted_font' if highlighted else 'font'])
+            draw.rectangle([x, y, x + node_width, y + self.NODE_HEIGHT], fill=fill, outline=edge)
+            if font_colour is not None:
+                draw.text((x + node_width / 2, y + self.NODE_HEIGHT / 2), names[user_id], fill=font_colour, font=self.font, anchor='mm')
+
+        # Save it
+        output = io.BytesIO()
+        image.save(output, 'PNG', compress_level=1)  # Trees are mostly flat colour, so the extra compression isn't worth the time
+        return output.getvalue()
+
+    def render_svg(self, user:FamilyTreeMember, gen_span:dict, ctu_hex:dict, names:typing.Dict[int, str]) -> str:
+        """Draws a generational span as an SVG - see render_png"""
+
+        width, height, nodes, lines = self.layout(gen_span, names)
+        background = self.get_colour(ctu_hex['background']) or 'none'
+        edge = self.get_colour(ctu_hex['edge']) or 'none'
+        all_text: typing.List[str] = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" font-family="sans-serif" font-size="{self.FONT_SIZE}">',
+            f'<rect width="100%" height="100%" fill="{background}"/>',
+        ]
+        for line in lines:
+            points = ' '.join(f'{x:.1f},{y:.1f}' for x, y in line)
+            all_text.append(f'<polyline points="{points}" fill="none" stroke="{edge}"/>')
+        for user_id, (x, y, node_width) in nodes.items():
+            highlighted = user_id == user.id
+            fill = self.get_colour(ctu_hex['highlighted_node' if highlighted else 'node']) or 'none'
+            font_colour = self.get_colour(ctu_hex['highlighted_font' if highlighted else 'font']) or 'none'
+            all_text.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{node_width:.1f}" height="{self.NODE_HEIGHT}" fill="{fill}" stroke="{edge}"/>')
+            all_text.append(f'<text x="{x + node_width / 2:.1f}" y="{y + self.NODE_HEIGHT / 2:.1f}" fill="{font_colour}" text-anchor="middle" dominant-baseline="central">{html.escape(names[user_id])}</text>')
+        all_text.append('</svg>')
+        return ''.join(all_text)
@@ -1,4 +1,6 @@
 import re as regex
+import functools
+import typing
 
 
 class Simplifier(object):
@@ -48,6 +50,24 @@ class Simplifier(object):
     # Get all the regex ready
     cousin_matcher = regex.compile(r"(?:parent's)(?: (?:parent|child)(?:'s)?)+ child")
 
+    # The pairs of steps that are cut down before simplifying, as in the pre-operations
+    step_pre_operations = [
+        (('parent', 'partner'), 'parent'),
+        (('partner', 'child'), 'child'),
+    ]
+
+    @classmethod
+    def get_ordinal(cls, x:int) -> str:
+        """Gives you the number with its ordinal suffix (1st, 2nd, etc)"""
+
+        if str(x).endswith('1') and x != 11:
+            return f"{x}st"
+        elif str(x).endswith('2') and x != 12:
+            return f"{x}nd"
+        elif str(x).endswith('3') and x != 13:
+            return f"{x}rd"
+        return f"{x}th"
+
     @classmethod
     def get_cousin_string(cls, k):
         """Gets the full cousin string"""
@@ -73,15 +93,7 @@ class Simplifier(object):
             return k.group(0)
         if x == 1 and y == 0:
             return "cousin"
-        cousin_string = ""
-        if str(x).endswith('1') and x != 11:
-            cousin_string += f"{x}st cousin "
-        elif str(x).endswith('2') and x != 12:
-            cousin_string += f"{x}nd cousin "
-        elif str(x).endswith('3') and x != 13:
-            cousin_string += f"{x}rd cousin "
-        else:
-            cousin_string += f"{x}th cousin "
+        cousin_string = f"{cls.get_ordinal(x)} cousin "
         if y == 0:
             return cousin_string.strip()
         return (cousin_string + {True: "1 time removed", False: f"{y} times removed"}[y==1]).strip()
@@ -105,3 +117,92 @@ class Simplifier(object):
         for o in cls.short_operations:
             string = o(string)
         return string
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def simplify_steps(cls, steps:typing.Tuple[str, ...]) -> str:
+        """Simplifies a tuple of relation steps ('parent', 'partner', 'child') into a nice
+        family relationship string, giving exactly the same output as simplify
+
+        Direct bloodlines (some parents followed by some children) are worked out arithmetically
+        from the amount of steps up and down, and anything else is passed through to simplify
+        Results are cached, since the same shapes of relation come up over and over
+        """
+
+        # A child's parent can leave junk in the string from the pre-operations, so let the string simplifier deal with it
+        for i in range(len(steps) - 1):
+            if steps[i] == 'child' and steps[i + 1] == 'parent':
+                return cls.simplify("'s ".join(steps))
+
+        # Do the same cutting down as the pre-operations
+        reduced = list(steps)
+        for _ in range(5):
+            for pair, replacement in cls.step_pre_operations:
+                reduced = cls._replace_step_pair(reduced, pair, replacement)
+
+        # See if it's a direct bloodline
+        up = 0
+        while up < len(reduced) and reduced[up] == 'parent':
+            up += 1
+        down = len(reduced) - up
+        if any(i != 'child' for i in reduced[up:]):
+            return cls.simplify("'s ".join(steps))
+        return cls.get_bloodline_string(up, down)
+
+    @staticmethod
+    def _replace_step_pair(steps:typing.List[str], pair:typing.Tuple[str, str], replacement:str) -> typing.List[str]:
+        """Replaces a pair of steps with a single step, left to right and without overlaps, like str.replace"""
+
+        output = []
+        i = 0
+        while i < len(steps):
+            if tuple(steps[i:i + 2]) == pair:
+                output.append(replacement)
+                i += 2
+            else:
+                output.append(steps[i])
+                i += 1
+        return output
+
+    @classmethod
+    def get_bloodline_string(cls, up:int, down:int) -> str:
+        """Gives you the relationship string for someone who's `up` parents then `down` children away"""
+
+        def descendant(n:int) -> str:
+            if n == 1:
+                return "child"
+            return ("great " * (n - 2)) + "grandchild"
+
+        # Your own line
+        if up == 0:
+            return descendant(down) if down else ""
+        if down == 0:
+            if up == 1:
+                return "parent"
+            return ("great " * (up - 2)) + "grandparent"
+
+        # Your siblings' line
+        if up == 1:
+            if down == 1:
+                return "sibling"
+            if down == 2:
+                return "niece/nephew"
+            if down == 3:
+                return "grandniece/nephew"
+            return f"grandniece/nephew's {descendant(down - 3)}"
+
+        # Aunts and uncles
+        if down == 1:
+            if up == 2:
+                return "aunt/uncle"
+            return ("great " * (up - 3)) + "grand aunt/uncle"
+
+        # Cousins
+        x = min(up, down) - 1  # nth cousin
+        y = abs(up - down)  # y times removed
+        if x == 1 and y == 0:
+            return "cousin"
+        cousin_string = f"{cls.get_ordinal(x)} cousin"
+        if y == 0:
+            return cousin_string
+        return f"{cousin_string} {'1 time removed' if y == 1 else f'{y} times removed'}"
@@ -0,0 +1,70 @@
+import collections
+import typing
+
+
+class TreeCache(object):
+    """A least-recently-used cache for things generated from a family tree (generational
+    spans, DOT scripts, etc), bounded by roughly how much memory the items take up
+
+    Keys should include the version of the family from FamilyComponentIndex, so that
+    nothing stale is ever given back - old versions just fall out of the end of the cache
+
+    Params:
+        max_size: int
+            The (rough) maximum amount of bytes the cache can hold
+    """
+
+    def __init__(self, max_size:int=32 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: typing.Dict[typing.Hashable, typing.Tuple[typing.Any, int]] = collections.OrderedDict()  # Key: (value, size)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key:typing.Hashable, default=None):
+        """Gets an item from the cache, marking it as recently used"""
+
+        try:
+            value, _ = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key:typing.Hashable, value, size:int) -> None:
+        """Adds an item to the cache, evicting the least recently used items to make room for it
+
+        Params:
+            key: Hashable
+                The key to store the item against
+            value
+                The item itself
+            size: int
+                About how many bytes the item takes up
+        """
+
+        # Don't bother with things that'd clear out the whole cache
+        if size > self.max_size:
+            return
+
+        # Add to the cache
+        if key in self._items:
+            self.size -= self._items.pop(key)[1]
+        self._items[key] = (value, size)
+        self.size += size
+
+        # Evict the oldest items
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self) -> None:
+        """Removes everything from the cache"""
+
+        self._items.clear()
+        self.size = 0
@@ -0,0 +1,157 @@
+import collections
+import hashlib
+import os
+import re
+import typing
+import uuid
+
+
+class RenderCache(object):
+    """An on-disk cache of rendered trees, where each file is named after the hash of
+    the DOT code and render options that made it, so identical trees only get rendered once
+
+    The least recently used files are deleted once the cache goes over its maximum size.
+    Since it's all on disk, it's picked back up (in order of last use) when the bot restarts
+
+    Params:
+        directory: str
+            The folder the rendered trees are saved in
+        max_size: int
+            How many bytes of files to keep before old ones are deleted
+    """
+
+    FILENAME_REGEX = re.compile(r'^(?P<key>[0-9a-f]{64})\.(?P<extension>\w+)$')
+
+    def __init__(self, directory:str, max_size:int):
+        self.directory = directory.rstrip('/')
+        self.max_size = max_size
+        self.size = 0
+        self._files: typing.Dict[str, typing.Dict[str, int]] = collections.OrderedDict()  # Key: {extension: size} - least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def __contains__(self, key:str) -> bool:
+        return key in self._files
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def get_key(dot_code:str, *options:str) -> str:
+        """Gives you the cache key for a DOT script rendered with the given options"""
+
+        hasher = hashlib.sha256(dot_code.encode())
+        for i in options:
+            hasher.update(b'\0' + i.encode())
+        return hasher.hexdigest()
+
+    def get_path(self, key:str, extension:str) -> str:
+        """Gives you where the file with the given key and extension is saved"""
+
+        return f'{self.directory}/{key}.{extension}'
+
+    def load(self) -> None:
+        """Picks up the files already in the cache directory, ordered by when they were last used"""
+
+        self._files.clear()
+        self.size = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        found = []
+        for entry in entries:
+            match = self.FILENAME_REGEX.search(entry.name)
+            if match is None or not entry.is_file():
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, match.group('key'), match.group('extension'), stat.st_size))
+        for _, key, extension, size in sorted(found):
+            self._files.setdefault(key, {})[extension] = size
+            self._files.move_to_end(key)
+            self.size += size
+        self.evict()
+
+    def get(self, key:str, extension:str) -> typing.Optional[bytes]:
+        """Gives you the content of a cached file, or None if it isn't cached
+        The file's read here rather than handing back its path, since another shard's cache can
+        delete it at any time
+
+        Params:
+            key: str
+                The key from get_key
+            extension: str
+                The type of file you want
+        """
+
+        files = self._files.get(key)
+        if files is None or extension not in files:
+            self.misses += 1
+            return None
+        path = self.get_path(key, extension)
+        try:
+            os.utime(path)  # So it keeps its place after a restart
+            with open(path, 'rb') as a:
+                data = a.read()
+        except OSError:
+            self.remove(key)  # Someone's deleted it from under us
+            self.misses += 1
+            return None
+        self._files.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def add(self, key:str, extension:str) -> None:
+        """Adds a file that's been saved to get_path(key, extension) into the cache, deleting
+        old files if the cache is too big now
+
+        Params:
+            key: str
+                The key from get_key
+            extension: str
+                The type of file that's been saved
+        """
+
+        size = os.path.getsize(self.get_path(key, extension))
+        files = self._files.setdefault(key, {})
+        self.size += size - files.get(extension, 0)
+        files[extension] = size
+        self._files.move_to_end(key)
+        self.evict()
+
+    def save(self, key:str, extension:str, data:bytes) -> None:
+        """Writes a file into the cache
+
+        Params:
+            key: str
+                The key from get_key
+            extension: str
+                The type of file being saved
+            data: bytes
+                The content of the file
+        """
+
+        # Write to a temp file first so nobody reads a half-written file
+        path = self.get_path(key, extension)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as a:
+            a.write(data)
+        os.replace(temp_path, path)
+        self.add(key, extension)
+
+    def remove(self, key:str) -> None:
+        """Deletes every file with the given key from the cache"""
+
+        for extension, size in self._files.pop(key, {}).items():
+            self.size -= size
+            try:
+                os.remove(self.get_path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> None:
+        """Deletes the least recently used files until the cache is within its maximum size"""
+
+        while self.size > self.max_size and len(self._files) > 1:
+            self.remove(next(iter(self._files)))
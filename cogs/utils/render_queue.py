@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import os
+import typing
+
+from discord.ext import commands
+
+
+class RenderQueueFull(commands.CommandError):
+    """Thrown when there are too many trees waiting to be rendered already"""
+
+    pass
+
+
+class TreeRenderFailed(commands.CommandError):
+    """Thrown when Graphviz couldn't render a tree"""
+
+    pass
+
+
+class RenderTicket(object):
+    """A place in the render queue
+
+    Params:
+        queue: RenderQueue
+            The queue the ticket is for
+        priority: int
+            Lower priorities get rendered first
+    """
+
+    __slots__ = ('queue', 'priority', 'sequence', 'joined_at', 'granted', 'released')
+
+    def __init__(self, queue:'RenderQueue', priority:int, sequence:int):
+        self.queue = queue
+        self.priority = priority
+        self.sequence = sequence
+        self.joined_at = asyncio.get_event_loop().time()
+        self.granted = asyncio.get_event_loop().create_future()
+        self.released = False
+
+    def __lt__(self, other:'RenderTicket') -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    @property
+    def position(self) -> int:
+        """The ticket's place in the queue, where 1 is next - 0 if it's being rendered"""
+
+        if self.granted.done():
+            return 0
+        return sum(1 for i in self.queue._waiting if i < self) + 1
+
+    async def wait(self) -> None:
+        """Waits until it's this ticket's turn to render"""
+
+        await asyncio.shield(self.granted)
+
+    def raise_priority(self, priority:int) -> None:
+        """Moves the ticket up the queue if it's still waiting and the given priority is ahead of its own"""
+
+        if priority >= self.priority or self.granted.done() or self.released:
+            return
+        self.priority = priority
+        heapq.heapify(self.queue._waiting)
+
+    def release(self) -> None:
+        """Gives the ticket's place back, whether it's been rendered or is still waiting"""
+
+        if self.released:
+            return
+        self.released = True
+        self.queue._release(self)
+
+
+class SharedRender(object):
+    """A render that's shared between everyone asking for the same tree at once, so that it's
+    queued at the best priority out of all of theirs and they can all be told where it is in the queue
+    """
+
+    __slots__ = ('future', 'ticket', 'priority', 'contexts')
+
+    def __init__(self):
+        self.future: asyncio.Future = None
+        self.ticket: RenderTicket = None  # Set once the render joins the queue
+        self.priority: int = None
+        self.contexts: typing.List[commands.Context] = []  # Everyone to tell about the render's place in the queue once it joins
+
+    def add_priority(self, priority:int) -> None:
+        """Makes sure the render is queued at least as high as the given priority"""
+
+        if self.priority is None or priority < self.priority:
+            self.priority = priority
+        if self.ticket is not None:
+            self.ticket.raise_priority(priority)
+
+
+class RenderQueue(object):
+    """Limits how many Graphviz processes can run at once, with everyone else waiting in a
+    queue ordered by priority (then by when they joined)
+
+    Params:
+        workers: int = None
+            How many renders can be run at once - defaults to the amount of CPU cores
+        max_queue_size: int = 50
+            How many renders can be waiting before new ones are turned away
+    """
+
+    def __init__(self, workers:int=None, max_queue_size:int=50):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue_size = max_queue_size
+        self.running = 0
+        self._waiting: typing.List[RenderTicket] = []  # A heap
+        self._sequence = itertools.count()
+
+        # Metrics
+        self.total_renders = 0
+        self.total_rejected = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def depth(self) -> int:
+        """How many renders are waiting for a worker"""
+
+        return len(self._waiting)
+
+    @property
+    def is_busy(self) -> bool:
+        """Whether or not a new render would have to wait"""
+
+        return self.running >= self.workers or bool(self._waiting)
+
+    @property
+    def average_wait_time(self) -> float:
+        """The average amount of time renders have had to wait for a worker, in seconds"""
+
+        if self.total_renders == 0:
+            return 0.0
+        return self.total_wait_time / self.total_renders
+
+    def join(self, priority:int=0) -> RenderTicket:
+        """Joins the queue, giving you a ticket to wait on - make sure to release it when you're done
+
+        Params:
+            priority: int = 0
+                Lower priorities get rendered first
+        """
+
+        if len(self._waiting) >= self.max_queue_size:
+            self.total_rejected += 1
+            raise RenderQueueFull("There are too many trees being rendered right now - please try again in a minute.")
+        ticket = RenderTicket(self, priority, next(self._sequence))
+        heapq.heappush(self._waiting, ticket)
+        self._dispatch()
+        return ticket
+
+    def _release(self, ticket:RenderTicket) -> None:
+        """Frees up the worker used by a ticket, or takes it out of the queue if it's still waiting"""
+
+        if ticket.granted.done():
+            self.running -= 1
+        else:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            ticket.granted.cancel()
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hands out any free workers to the front of the queue"""
+
+        now = asyncio.get_event_loop().time()
+        while self.running < self.workers and self._waiting:
+            ticket = heapq.heappop(self._waiting)
+            self.running += 1
+            wait_time = now - ticket.joined_at
+            self.total_renders += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            ticket.granted.set_result(None)
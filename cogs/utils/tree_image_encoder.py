@@ -0,0 +1,104 @@
+import collections
+import io
+import math
+import time
+import typing
+
+from PIL import Image
+
+
+class TreeImageEncoder(object):
+    """Converts rendered tree PNGs into other formats, shrinking them down when they're too big
+    to upload, and keeps track of how big each format comes out and how long it takes
+
+    Params:
+        auto_threshold: int
+            How many bytes a PNG can be before it's swapped for whichever format comes out smallest
+    """
+
+    FORMATS = {
+        'png': 'png',
+        'palette': 'png',  # A PNG reduced to 256 colours
+        'webp': 'webp',  # Lossless, so the names stay readable
+        'svg': 'svg',  # Rendered as an SVG to begin with - never converted to
+    }  # Format: file extension
+    MAX_WEBP_SIZE = 16383  # The biggest width or height that a WebP can have
+    MAX_DOWNSCALE_ATTEMPTS = 5
+
+    def __init__(self, auto_threshold:int):
+        self.auto_threshold = auto_threshold
+        self.stats: typing.Dict[str, typing.List[float]] = collections.defaultdict(lambda: [0, 0, 0.0])  # Format: [count, total bytes, total encode time]
+        self.downscaled = 0
+
+    def record(self, image_format:str, size:int, encode_time:float) -> None:
+        """Stores the size and encode time of an image"""
+
+        stats = self.stats[image_format]
+        stats[0] += 1
+        stats[1] += size
+        stats[2] += encode_time
+
+    @staticmethod
+    def encode(image:Image.Image, image_format:str) -> bytes:
+        """Saves an image in the given format"""
+
+        output = io.BytesIO()
+        if image_format == 'palette':
+            image.convert('RGB').quantize(256, method=Image.FASTOCTREE).save(output, 'PNG', optimize=True)
+        elif image_format == 'webp':
+            image.save(output, 'WEBP', lossless=True, quality=50, method=2)
+        else:
+            image.save(output, 'PNG', compress_level=6)
+        return output.getvalue()
+
+    def convert(self, png_data:bytes, image_format:typing.Optional[str], max_size:int) -> typing.Tuple[bytes, str]:
+        """Converts a PNG into the given format, making sure that it fits into the max size
+
+        Params:
+            png_data: bytes
+                The rendered tree
+            image_format: str
+                One of the keys from FORMATS (other than svg) - if not given, the PNG is kept unless
+                it's bigger than the auto threshold, in which case the smallest format is used
+            max_size: int
+                How many bytes the image can be before it's downscaled to fit
+
+        Returns:
+            The image data and its format - only the format that's given back is recorded in the stats
+        """
+
+        # See if there's anything to be done
+        if image_format in (None, 'png') and len(png_data) <= min(self.auto_threshold, max_size):
+            self.record('png', len(png_data), 0.0)
+            return png_data, 'png'
+        start_time = time.perf_counter()
+        try:
+            image = Image.open(io.BytesIO(png_data))
+        except Image.DecompressionBombError:
+            self.record('png', len(png_data), 0.0)
+            return png_data, 'png'  # Too many pixels for Pillow to be willing to open, so it'll have to go as it is
+
+        # Convert the image
+        if image_format is None:
+            candidates = [('png', png_data), ('palette', self.encode(image, 'palette'))]
+            if max(image.size) <= self.MAX_WEBP_SIZE:
+                candidates.append(('webp', self.encode(image, 'webp')))
+            image_format, data = min(candidates, key=lambda i: len(i[1]))
+        elif image_format == 'png':
+            data = png_data
+        else:
+            if image_format == 'webp' and max(image.size) > self.MAX_WEBP_SIZE:
+                image_format = 'palette'  # Too big to be a WebP
+            data = self.encode(image, image_format)
+
+        # Shrink it down until it fits
+        attempts = 0
+        while len(data) > max_size and attempts < self.MAX_DOWNSCALE_ATTEMPTS:
+            scale = math.sqrt(max_size / len(data)) * 0.9
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+            data = self.encode(image, image_format)
+            attempts += 1
+        if attempts:
+            self.downscaled += 1
+        self.record(image_format, len(data), time.perf_counter() - start_time)
+        return data, image_format
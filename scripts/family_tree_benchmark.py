@@ -0,0 +1,222 @@
+"""Builds some synthetic families, checks that the fast family tree code gives the same answers as
+the simple versions it replaced, and times span, generational_span and build_dot_script on them
+
+Run from the root of the repo with `python scripts/family_tree_benchmark.py`
+"""
+
+import argparse
+import collections
+import itertools
+import os
+import random
+import sys
+import time
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils.customised_tree_user import CustomisedTreeUser
+from cogs.utils.family_tree.family_tree_member import FamilyTreeMember
+from cogs.utils.family_tree.relation_simplifier import Simplifier
+
+
+def reset_tree() -> None:
+    """Removes everyone from the family tree"""
+
+    FamilyTreeMember.all_users.clear()
+    FamilyTreeMember.family_components.clear()
+    FamilyTreeMember.tree_cache.clear()
+    FamilyTreeMember.ancestors.clear()
+
+
+def build_deep_family(generations:int, start_id:int=1) -> FamilyTreeMember:
+    """Makes a single bloodline where everyone is married with one child, giving back the top of it"""
+
+    top = person = FamilyTreeMember.get(start_id)
+    for i in range(generations):
+        partner = FamilyTreeMember.get(start_id + i * 2 + 1)
+        child = FamilyTreeMember.get(start_id + i * 2 + 2)
+        person.add_partner(partner)
+        person.add_child(child)
+        person = child
+    return top
+
+
+def build_wide_family(children:int, grandchildren:int, start_id:int=1) -> FamilyTreeMember:
+    """Makes a couple with lots of married children, who all have children of their own"""
+
+    ids = itertools.count(start_id)
+    root = FamilyTreeMember.get(next(ids))
+    root.add_partner(FamilyTreeMember.get(next(ids)))
+    for _ in range(children):
+        child = FamilyTreeMember.get(next(ids))
+        root.add_child(child)
+        child.add_partner(FamilyTreeMember.get(next(ids)))
+        for _ in range(grandchildren):
+            child.add_child(FamilyTreeMember.get(next(ids)))
+    return root
+
+
+def build_random_families(users:int, relations:int, allow_loops:bool, seed:int) -> typing.List[FamilyTreeMember]:
+    """Adds random marriages and children between a set of users, giving back all of them
+    If loops aren't allowed, relatives can't marry or adopt each other, so every family is a tree"""
+
+    rng = random.Random(seed)
+    people = [FamilyTreeMember.get(i) for i in range(1, users + 1)]
+    for _ in range(relations):
+        a, b = rng.choice(people), rng.choice(people)
+        if a == b or (not allow_loops and a.is_related(b)):
+            continue
+        if rng.random() < 0.4:
+            if not a._partner and not b._partner:
+                a.add_partner(b)
+        elif not b._parent:
+            a.add_child(b)
+    return people
+
+
+def recursive_span(user:FamilyTreeMember, people_list:list=None, add_parent:bool=False, expand_upwards:bool=False) -> list:
+    """The recursive span that FamilyTreeMember.span replaced"""
+
+    if people_list is None:
+        people_list = []
+    if user in people_list:
+        return people_list
+    people_list.append(user)
+    if expand_upwards and add_parent and user._parent:
+        recursive_span(user.parent, people_list, add_parent=True, expand_upwards=expand_upwards)
+    for child in user.children:
+        recursive_span(child, people_list, add_parent=False, expand_upwards=expand_upwards)
+    if user._partner:
+        recursive_span(user.partner, people_list, add_parent=True, expand_upwards=expand_upwards)
+    return people_list
+
+
+def recursive_generational_span(user:FamilyTreeMember, people_dict:dict=None, depth:int=0, add_parent:bool=False, expand_upwards:bool=False, all_people:list=None) -> dict:
+    """The recursive generational_span that FamilyTreeMember.generational_span replaced"""
+
+    if people_dict is None:
+        people_dict = {}
+    if all_people is None:
+        all_people = []
+    if user.id in all_people:
+        return people_dict
+    all_people.append(user.id)
+    people_dict.setdefault(depth, []).append(user)
+    for child in user.children:
+        recursive_generational_span(child, people_dict, depth + 1, add_parent=False, expand_upwards=expand_upwards, all_people=all_people)
+    if user._partner:
+        recursive_generational_span(user.partner, people_dict, depth, add_parent=True, expand_upwards=expand_upwards, all_people=all_people)
+    if expand_upwards and add_parent and user._parent:
+        recursive_generational_span(user.parent, people_dict, depth - 1, add_parent=True, expand_upwards=expand_upwards, all_people=all_people)
+    return people_dict
+
+
+def bfs_path_length(start:FamilyTreeMember, end:FamilyTreeMember) -> typing.Optional[int]:
+    """Gives you how many steps the shortest path between two users is, with a plain breadth-first search"""
+
+    start_key, end_key = (start.id, start._guild_id), (end.id, end._guild_id)
+    distances = {start_key: 0}
+    queue = collections.deque([start_key])
+    while queue:
+        key = queue.popleft()
+        if key == end_key:
+            return distances[key]
+        for _, new_key in FamilyTreeMember.get_relation_steps(key):
+            if new_key not in distances:
+                distances[new_key] = distances[key] + 1
+                queue.append(new_key)
+    return None
+
+
+def check_spans(people:typing.List[FamilyTreeMember]) -> None:
+    """Makes sure the iterative spans visit everyone in the same order as the recursive ones"""
+
+    for user in people:
+        for kwargs in [{}, {'add_parent': True, 'expand_upwards': True}]:
+            assert [i.id for i in user.span(**kwargs)] == [i.id for i in recursive_span(user, **kwargs)], (user, kwargs)
+            iterative = user.generational_span(**kwargs)
+            recursive = recursive_generational_span(user, **kwargs)
+            assert {k: [i.id for i in v] for k, v in iterative.items()} == {k: [i.id for i in v] for k, v in recursive.items()}, (user, kwargs)
+
+
+def check_simplifier(max_length:int) -> int:
+    """Makes sure simplify_steps gives the same string as simplify for every path up to the given length"""
+
+    checked = 0
+    for length in range(max_length + 1):
+        for steps in itertools.product(('parent', 'partner', 'child'), repeat=length):
+            assert Simplifier.simplify_steps(steps) == Simplifier.simplify("'s ".join(steps)), steps
+            checked += 1
+    return checked
+
+
+def check_relation_paths(people:typing.List[FamilyTreeMember], pairs:int, seed:int) -> None:
+    """Makes sure the paths found through the common ancestor index are as short as a plain search's"""
+
+    rng = random.Random(seed)
+    for _ in range(pairs):
+        a, b = rng.choice(people), rng.choice(people)
+        path = a.get_relation_path(b)
+        length = bfs_path_length(a, b)
+        assert (path is None) == (length is None), (a, b)
+        if path is not None:
+            assert len(path) == length, (a, b, path, length)
+
+
+def time_call(function:typing.Callable, *args, repeat:int=5, **kwargs) -> float:
+    """Gives you the fastest time (in milliseconds) out of a few calls of a function"""
+
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start_time)
+    return best * 1000
+
+
+def benchmark(name:str, root:FamilyTreeMember) -> None:
+    """Prints how long the spans and DOT script take for the given family, against the recursive spans"""
+
+    span_time = time_call(root.span, add_parent=True, expand_upwards=True)
+    recursive_span_time = time_call(recursive_span, root, add_parent=True, expand_upwards=True)
+    gen_span_time = time_call(root.generational_span)
+    recursive_gen_span_time = time_call(recursive_generational_span, root)
+    gen_span = root.generational_span()
+    names = {i.id: f"User {i.id}" for generation in gen_span.values() for i in generation}
+    ctu_hex = CustomisedTreeUser(root.id).hex
+    dot_time = time_call(root.build_dot_script, gen_span, ctu_hex, names)
+    print(
+        f"{name} ({root.family_member_count} people): "
+        f"span {span_time:.1f}ms (recursive {recursive_span_time:.1f}ms), "
+        f"generational_span {gen_span_time:.1f}ms (recursive {recursive_gen_span_time:.1f}ms), "
+        f"build_dot_script {dot_time:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generations", type=int, default=400, help="How many generations deep the deep family is")
+    parser.add_argument("--children", type=int, default=300, help="How many children the wide family's root has")
+    parser.add_argument("--seed", type=int, default=0, help="The seed for the random families")
+    args = parser.parse_args()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.generations * 10))
+
+    # Check that everything gives the same answers
+    for allow_loops in (False, True):
+        reset_tree()
+        people = build_random_families(600, 1000, allow_loops, args.seed)
+        check_spans(people[::20])
+        check_relation_paths(people, 1000, args.seed)
+    print("Spans and relation paths match")
+    print(f"Simplified {check_simplifier(8)} paths the same both ways")
+
+    # Time the deep and wide families
+    reset_tree()
+    benchmark("Deep family", build_deep_family(args.generations))
+    reset_tree()
+    benchmark("Wide family", build_wide_family(args.children, 3))
+
+
+if __name__ == '__main__':
+    main()